@@ -0,0 +1,122 @@
+"""Compares the speed and quality of the sentence encoders on the NDC keyword sets
+
+Quality is measured as leave-one-out topic retrieval: every keyword of a
+keyword file is assigned to the topic whose remaining keywords it correlates
+with most (max inner product, as in KeywordCorrelator), and the share of
+keywords assigned to their own topic is reported. Topics differing only in
+case are merged. The margin is the mean similarity of a keyword to its own
+topic minus the mean similarity to the other topics.
+
+Speed is measured by embedding text windows of the test documents, as in a
+screening pass over a corpus; the embedding cache is bypassed.
+
+    python benchmarks/encoder_comparison.py
+    python benchmarks/encoder_comparison.py --encoders hashed-ngram spacy:en_core_web_md
+"""
+
+import argparse
+import codecs
+import glob
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from encoders import MODEL_URL, get_sentence_encoder  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_topics(path: str) -> Dict[str, List[str]]:
+    """Loads a keyword file, merging topics that only differ in case."""
+    with codecs.open(path, encoding="utf8") as f:
+        keyword_file = json.load(f)
+    topics = {}
+    for topic, keywords in keyword_file.items():
+        topics.setdefault(topic.lower(), [])
+        topics[topic.lower()].extend(k for k in keywords if k not in topics[topic.lower()])
+    return topics
+
+
+def topic_retrieval(encoder, topics: Dict[str, List[str]]) -> Dict[str, float]:
+    """Leave-one-out topic retrieval accuracy and similarity margin of an encoder."""
+    keywords = [k for topic_keywords in topics.values() for k in topic_keywords]
+    labels = np.array([i for i, topic_keywords in enumerate(topics.values())
+                       for _ in topic_keywords])
+    embeddings = np.asarray(encoder(keywords), dtype=np.float32)
+    similarity = np.inner(embeddings, embeddings)
+    np.fill_diagonal(similarity, -np.inf)
+
+    best = np.full((len(keywords), len(topics)), -np.inf)
+    mean = np.zeros((len(keywords), len(topics)))
+    for t in range(len(topics)):
+        columns = similarity[:, labels == t]
+        best[:, t] = columns.max(axis=1)
+        finite = np.where(np.isfinite(columns), columns, 0)
+        mean[:, t] = finite.sum(axis=1) / np.maximum(np.isfinite(columns).sum(axis=1), 1)
+
+    rows = np.arange(len(keywords))
+    other = np.ones_like(mean, dtype=bool)
+    other[rows, labels] = False
+    margin = mean[rows, labels] - (mean * other).sum(axis=1) / other.sum(axis=1)
+    return {
+        'keywords': len(keywords),
+        'accuracy': float(np.mean(best.argmax(axis=1) == labels)),
+        'margin': float(np.mean(margin)),
+    }
+
+
+def load_windows(n_windows: int, window_size: int) -> List[str]:
+    """Cuts the test documents into windows of window_size words."""
+    windows = []
+    for path in sorted(glob.glob(os.path.join(REPO_DIR, 'test_resources', 'data', '*.txt'))):
+        with codecs.open(path, errors="ignore", encoding="utf8") as f:
+            words = f.read().split()
+        windows.extend(' '.join(words[i:i + window_size])
+                       for i in range(0, len(words), window_size))
+        if len(windows) >= n_windows:
+            break
+    return windows[:n_windows]
+
+
+def throughput(encoder, windows: List[str], batch_size: int) -> float:
+    """Embedded windows per second."""
+    encoder(windows[:batch_size])  # loads the model, if any
+    start = time.perf_counter()
+    for i in range(0, len(windows), batch_size):
+        encoder(windows[i:i + batch_size])
+    return len(windows) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--encoders', nargs='+', default=['hashed-ngram', 'spacy:en_core_web_md', MODEL_URL],
+                        help='encoder specifications, see encoders.get_sentence_encoder')
+    parser.add_argument('--windows', type=int, default=5000, help='number of text windows to embed')
+    parser.add_argument('--window-size', type=int, default=30, help='words per window')
+    parser.add_argument('--batch-size', type=int, default=256, help='windows per encoder call')
+    args = parser.parse_args()
+
+    keyword_files = sorted(glob.glob(os.path.join(REPO_DIR, 'ndc_keywords', '*.json')))
+    windows = load_windows(args.windows, args.window_size)
+
+    print(f"{'encoder':<55} {'keyword file':<22} {'kwds':>5} {'accuracy':>9} {'margin':>7} {'windows/s':>10}")
+    for spec in args.encoders:
+        encoder = get_sentence_encoder(spec)
+        try:
+            speed = throughput(encoder, windows, args.batch_size)
+            results = [(path, topic_retrieval(encoder, load_topics(path))) for path in keyword_files]
+        except Exception as e:  # e.g. no network access or the model is not installed
+            print(f"{encoder.model_id:<55} unavailable: {e!r}")
+            continue
+        for path, result in results:
+            print(f"{encoder.model_id:<55} {os.path.basename(path):<22} {result['keywords']:>5} "
+                  f"{result['accuracy']:>9.2f} {result['margin']:>7.3f} {speed:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Measures the cold start (import time) of the GIZ-Policy modules
+
+Every module is imported in a fresh interpreter, so nothing is shared between
+measurements, and the median of several runs is reported. To see the effect
+of a change, point --code-dir at a checkout of an older revision, e.g.
+
+    git worktree add /tmp/giz-old <revision>
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --code-dir /tmp/giz-old/code
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ['datahelper', 'nlpanalysis', 'nlppreprocess', 'correlation', 'n_gram_correlation']
+
+TIMER = ("import time; start = time.perf_counter(); import {module}; "
+         "print(time.perf_counter() - start)")
+
+
+def time_import(module: str, code_dir: str, repeat: int) -> float:
+    """Returns the median import time of a module in seconds, nan if the import fails."""
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', TIMER.format(module=module)],
+                                cwd=code_dir,
+                                capture_output=True,
+                                text=True)
+        if result.returncode != 0:
+            return float('nan')
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def main():
+    default_code_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--code-dir', default=default_code_dir,
+                        help='folder containing the modules to import')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per module')
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    args = parser.parse_args()
+
+    print(f"{'module':<20} import time [s]")
+    for module in args.modules:
+        print(f"{module:<20} {time_import(module, args.code_dir, args.repeat):.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""Benchmarks the pipeline stages on the test documents and gates regressions
+
+Every stage runs on synthetic documents of growing size, made by
+concatenating the documents of test_resources/data, so the output shows how
+each stage scales. A stage runs in a fresh process per input size: its setup
+(loading models, parsing the input it needs) is not timed, and the peak
+resident memory of the process is reported next to the wall time (median of
+--repeat runs) and the throughput in input words per second. The sentence
+encoder defaults to the offline hashed n-gram encoder, so no model has to be
+downloaded.
+
+    python benchmarks/pipeline_benchmark.py --output benchmark.json
+    python benchmarks/pipeline_benchmark.py --baseline benchmark.json --threshold 0.2
+
+With --baseline the run fails (exit code 1) if a stage takes more than
+(1 + threshold) times its baseline wall time. Timings depend on the machine,
+so no baseline is shipped with the repository: record one with --output on
+the machine that runs the comparison (e.g. from the main branch) and pass
+that file as --baseline to later runs. A stage that raises an error is
+reported as failed and also makes the run exit with code 1.
+"""
+
+import argparse
+import codecs
+import copy
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import queue as queue_module
+import tempfile
+import time
+import traceback
+from typing import Callable, Dict, List, Tuple
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(CODE_DIR)
+sys.path.insert(0, CODE_DIR)
+
+STAGES = ['fix_contractions', 'preprocess_doc', 'filter_modify_tokens',
+          'make_filtered_tokens_from_ndc', 'keyword_matching', 'keyword_correlator']
+
+# stages whose input does not depend on the document, they only run for the smallest size
+SIZE_INDEPENDENT_STAGES = ['make_filtered_tokens_from_ndc']
+
+WINDOW_WORDS = 30
+
+
+def _rss_mb() -> float:
+    """Peak resident memory of this process so far in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _ndc_keywords() -> Dict[str, Dict[str, List[str]]]:
+    ndc_dicts = {}
+    for path in sorted(glob.glob(os.path.join(REPO_DIR, 'ndc_keywords', '*.json'))):
+        with open(path) as f:
+            ndc_dicts[os.path.basename(path)] = json.load(f)
+    return ndc_dicts
+
+
+def setup_stage(stage: str, doc_path: str, encoder: str) -> Callable[[], int]:
+    """Prepares a stage and returns a function running it once.
+
+    The function returns the number of input words it processed.
+    """
+    import nlppreprocess
+    with codecs.open(doc_path, errors="ignore", encoding="utf8") as f:
+        text = f.read()
+    n_words = len(text.split())
+
+    if stage == 'fix_contractions':
+        def run():
+            # a new expander, so the memo of earlier runs does not help
+            nlppreprocess.contraction_expander = nlppreprocess.ContractionExpander()
+            nlppreprocess.fix_contractions(doc_path)
+            return n_words
+    elif stage == 'preprocess_doc':
+        nlppreprocess.get_nlp()
+
+        def run():
+            nlppreprocess.preprocess_doc(doc_path)
+            return n_words
+    elif stage == 'filter_modify_tokens':
+        tokens, _, _ = nlppreprocess.preprocess_doc(doc_path)
+
+        def run():
+            nlppreprocess.filter_modify_tokens(tokens)
+            return n_words
+    elif stage == 'make_filtered_tokens_from_ndc':
+        ndc_dicts = _ndc_keywords()
+        nlppreprocess.get_nlp()
+
+        def run():
+            # make_filtered_tokens_from_ndc adds the topics to the keyword lists
+            for ndc_dict in copy.deepcopy(ndc_dicts).values():
+                nlppreprocess.make_filtered_tokens_from_ndc(ndc_dict)
+            return sum(len(k) for d in ndc_dicts.values() for k in d.values())
+    elif stage == 'keyword_matching':
+        from keyword_matcher import KeywordMatcher
+        ndc_paths = sorted(glob.glob(os.path.join(REPO_DIR, 'ndc_keywords', '*.json')))
+        matcher = KeywordMatcher.from_files(ndc_paths=ndc_paths)
+
+        def run():
+            matcher.find(text)
+            return n_words
+    elif stage == 'keyword_correlator':
+        import correlation
+        words = text.split()
+        windows = [' '.join(words[i:i + WINDOW_WORDS]) for i in range(0, len(words), WINDOW_WORDS)]
+        keywords = [k for d in _ndc_keywords().values() for ks in d.values() for k in ks]
+        correlator = correlation.KeywordCorrelator(keywords, encoder=encoder)
+
+        def run():
+            # a new cache, so every window is embedded again
+            correlation._EMBEDDING_CACHES.clear()
+            correlator.embed = correlation.get_embedding_cache(encoder)
+            correlator(windows)
+            return n_words
+    else:
+        raise ValueError(f"Unknown stage '{stage}', choose one of {STAGES}")
+    return run
+
+
+def _measure_in_process(stage: str, doc_path: str, encoder: str, repeat: int, queue) -> None:
+    os.environ.pop('GIZ_EMBEDDING_CACHE_DIR', None)
+    try:
+        run = setup_stage(stage, doc_path, encoder)
+        rss_setup = _rss_mb()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            n_words = run()
+            timings.append(time.perf_counter() - start)
+    except Exception:
+        queue.put({'error': traceback.format_exc()})
+        return
+    wall_time = statistics.median(timings)
+    queue.put({
+        'wall_time_s': wall_time,
+        'words': n_words,
+        'words_per_s': n_words / max(wall_time, 1e-9),
+        'peak_rss_mb': _rss_mb(),
+        'stage_rss_mb': _rss_mb() - rss_setup,
+    })
+
+
+def measure(stage: str, doc_path: str, encoder: str, repeat: int) -> Dict[str, float]:
+    """Runs a stage in a fresh process and returns its measurements.
+
+    If the stage fails, or its process dies without a result, the returned
+    record only holds an 'error' message.
+    """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure_in_process,
+                              args=(stage, doc_path, encoder, repeat, queue))
+    process.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except queue_module.Empty:
+            if not process.is_alive():
+                # the result may have arrived just before the process exited
+                try:
+                    result = queue.get(timeout=1)
+                except queue_module.Empty:
+                    result = {'error': f"process exited with code {process.exitcode} without a result"}
+                break
+    process.join()
+    return result
+
+
+def make_synthetic_docs(sizes: List[int], out_dir: str) -> List[Tuple[int, str]]:
+    """Writes documents of the given numbers of characters by concatenating the test documents."""
+    texts = []
+    for path in sorted(glob.glob(os.path.join(REPO_DIR, 'test_resources', 'data', '*.txt'))):
+        with codecs.open(path, errors="ignore", encoding="utf8") as f:
+            texts.append(f.read())
+    corpus = '\n\n'.join(texts)
+
+    docs = []
+    for size in sizes:
+        text = (corpus * (size // len(corpus) + 1))[:size]
+        path = os.path.join(out_dir, f'synthetic_{size}.txt')
+        with codecs.open(path, 'w', encoding='utf8') as f:
+            f.write(text)
+        docs.append((size, path))
+    return docs
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float,
+            min_delta_s: float = 0.01) -> List[str]:
+    """Lists the stages that got slower than their baseline by more than threshold.
+
+    Slowdowns of less than min_delta_s seconds are timing noise and ignored.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result['wall_time_s'] / max(baseline[key]['wall_time_s'], 1e-9)
+        delta = result['wall_time_s'] - baseline[key]['wall_time_s']
+        if ratio > 1 + threshold and delta > min_delta_s:
+            regressions.append(f"{key}: {result['wall_time_s']:.3f}s vs "
+                               f"{baseline[key]['wall_time_s']:.3f}s baseline ({ratio:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100000, 300000, 900000],
+                        help='characters of the synthetic input documents (spacy parses at most 1000000)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage and size')
+    parser.add_argument('--encoder', default='hashed-ngram',
+                        help='sentence encoder of keyword_correlator, see encoders.get_sentence_encoder')
+    parser.add_argument('--output', help='json file to write the results to')
+    parser.add_argument('--baseline', help='json file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative slowdown against the baseline')
+    parser.add_argument('--min-delta', type=float, default=0.01,
+                        help='slowdowns of fewer seconds are ignored as noise')
+    args = parser.parse_args()
+
+    results = {}
+    failed = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        docs = make_synthetic_docs(sorted(args.sizes), out_dir)
+        print(f"{'stage':<32} {'chars':>9} {'wall [s]':>9} {'words/s':>10} {'peak RSS [MB]':>14} {'stage RSS [MB]':>15}")
+        for stage in args.stages:
+            stage_docs = docs[:1] if stage in SIZE_INDEPENDENT_STAGES else docs
+            for size, doc_path in stage_docs:
+                result = measure(stage, doc_path, args.encoder, args.repeat)
+                if 'error' in result:
+                    failed[f'{stage}@{size}'] = result['error']
+                    print(f"{stage:<32} {size:>9} FAILED")
+                    continue
+                results[f'{stage}@{size}'] = result
+                print(f"{stage:<32} {size:>9} {result['wall_time_s']:>9.3f} {result['words_per_s']:>10.0f} "
+                      f"{result['peak_rss_mb']:>14.0f} {result['stage_rss_mb']:>15.0f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'encoder': args.encoder, 'stages': results}, f, indent=1)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['stages']
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"Stages slower than the baseline by more than {args.threshold:.0%}:")
+            for regression in regressions:
+                print('  ' + regression)
+        else:
+            print(f"No stage slower than the baseline by more than {args.threshold:.0%}")
+
+    if failed:
+        print("Failed stages:")
+        for key, error in failed.items():
+            print(f"  {key}:\n{error}")
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""Positional inverted index of a policy document corpus
+
+The index maps every (lowercase, lemmatized) term of the filtered documents
+to the documents it occurs in and its token positions there, so questions
+about the corpus are answered without reading or parsing the source files
+again. Positions count the tokens kept by nlppreprocess.filter_token_array,
+i.e. stop words and punctuation do not separate the words of a phrase.
+
+On disk an index is a folder with
+    meta.json     the documents, their filtered lengths and the build settings
+    lexicon.json  for every term: offset and size of its posting list, its
+                  document frequency and its collection frequency
+    postings.bin  all posting lists, variable-byte encoded
+
+A posting list holds the document id gaps, the term frequency per document
+and the position gaps (restarting in every document). postings.bin is
+memory-mapped at query time and only the posting lists of the queried terms
+are decoded.
+
+    Typical usage example:
+
+    policy_doc_df = read_docs_to_df('../test_resources/data')
+    build_corpus_index(policy_doc_df, '../cache/corpus_index')
+
+    index = CorpusIndex('../cache/corpus_index')
+    index.phrase_query('early warning systems')
+    index.proximity_query('early warning systems', 'food security', window=50)
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from doccache import DocCache
+from nlppreprocess import contraction_expander, filter_token_array, iter_preprocess_corpus, pipeline_profile
+
+INDEX_VERSION = 1
+
+
+def varbyte_encode(values: np.ndarray) -> np.ndarray:
+    """Encodes non-negative integers with 7 bits per byte, low bits first.
+
+    Every byte but the last of a value has its high bit set.
+
+    Args:
+        values (np.ndarray): non-negative integers
+
+    Returns (np.ndarray):
+        the encoded bytes
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    remaining = values >> np.uint64(7)
+    while remaining.any():
+        n_bytes += remaining > 0
+        remaining >>= np.uint64(7)
+
+    value_ids = np.repeat(np.arange(len(values)), n_bytes)
+    byte_ends = np.cumsum(n_bytes)
+    byte_in_value = np.arange(len(value_ids)) - (byte_ends - n_bytes)[value_ids]
+    encoded = (values[value_ids] >> (np.uint64(7) * byte_in_value.astype(np.uint64))) & np.uint64(0x7F)
+    encoded[np.arange(len(value_ids)) != byte_ends[value_ids] - 1] |= np.uint64(0x80)
+    return encoded.astype(np.uint8)
+
+
+def varbyte_decode(encoded: np.ndarray) -> np.ndarray:
+    """Decodes the output of varbyte_encode.
+
+    Args:
+        encoded (np.ndarray): encoded bytes
+
+    Returns (np.ndarray):
+        the decoded integers
+    """
+    encoded = np.asarray(encoded, dtype=np.uint8)
+    if len(encoded) == 0:
+        return np.zeros(0, dtype=np.int64)
+    value_ends = np.flatnonzero(encoded < 0x80)
+    value_starts = np.concatenate(([0], value_ends[:-1] + 1))
+    value_ids = np.repeat(np.arange(len(value_ends)), value_ends - value_starts + 1)
+    byte_in_value = np.arange(len(encoded)) - value_starts[value_ids]
+    parts = (encoded & 0x7F).astype(np.uint64) << (np.uint64(7) * byte_in_value.astype(np.uint64))
+    return np.add.reduceat(parts, value_starts).astype(np.int64)
+
+
+def _write_json(path: str, content: object) -> None:
+    with open(path + '.tmp', 'w') as f:
+        json.dump(content, f)
+    os.replace(path + '.tmp', path)
+
+
+def build_corpus_index(doc_df: pd.DataFrame,
+                       index_dir: str,
+                       profile: str = 'lemma',
+                       cache: Optional[DocCache] = None,
+                       n_process: int = 1) -> None:
+    """Preprocesses the documents of a corpus and writes their positional index.
+
+    Args:
+        doc_df (pd.DataFrame): document table as returned by datahelper.read_docs_to_df
+        index_dir (str): folder to write the index to
+        profile (str): name of the pipeline profile to parse with (see PIPELINE_PROFILES)
+        cache (Optional[DocCache]): cache of parsed documents
+        n_process (int): number of processes to parse with
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    term_ids: Dict[str, int] = {}
+    doc_terms, doc_ids, doc_positions, doc_lengths = [], [], [], []
+    # only the postings of a document are kept, not its parsed tokens
+    for doc_id, (tokens, _, _) in iter_preprocess_corpus(doc_df, profile=profile, n_process=n_process,
+                                                         cache=cache):
+        filtered_tokens, _ = filter_token_array(tokens)
+        forms, inverse = np.unique(filtered_tokens.to_array('ORTH'), return_inverse=True)
+        form_ids = np.array([term_ids.setdefault(filtered_tokens.vocab.strings[int(form)], len(term_ids))
+                             for form in forms], dtype=np.int64)
+        doc_terms.append(form_ids[inverse.reshape(-1)])
+        doc_ids.append(np.full(len(filtered_tokens), doc_id, dtype=np.int64))
+        doc_positions.append(np.arange(len(filtered_tokens), dtype=np.int64))
+        doc_lengths.append(len(filtered_tokens))
+
+    terms = np.concatenate(doc_terms) if doc_terms else np.zeros(0, dtype=np.int64)
+    docs = np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int64)
+    positions = np.concatenate(doc_positions) if doc_positions else np.zeros(0, dtype=np.int64)
+    order = np.lexsort((positions, docs, terms))
+    terms, docs, positions = terms[order], docs[order], positions[order]
+    term_bounds = np.flatnonzero(np.diff(terms, prepend=-1, append=-1))
+
+    term_names = list(term_ids)
+    lexicon = {}
+    offset = 0
+    with open(os.path.join(index_dir, 'postings.bin.tmp'), 'wb') as f:
+        for start, end in zip(term_bounds[:-1], term_bounds[1:]):
+            term_docs, term_positions = docs[start:end], positions[start:end]
+            doc_starts = np.flatnonzero(np.diff(term_docs, prepend=-1))
+            posting_docs = term_docs[doc_starts]
+            frequencies = np.diff(np.append(doc_starts, len(term_docs)))
+            position_gaps = np.diff(term_positions, prepend=0)
+            # the first position of every document is stored as is
+            position_gaps[doc_starts] = term_positions[doc_starts]
+            encoded = varbyte_encode(np.concatenate(
+                (np.diff(posting_docs, prepend=0), frequencies, position_gaps)))
+            f.write(encoded.tobytes())
+            lexicon[term_names[terms[start]]] = [offset, len(encoded), len(posting_docs), int(end - start)]
+            offset += len(encoded)
+    os.replace(os.path.join(index_dir, 'postings.bin.tmp'), os.path.join(index_dir, 'postings.bin'))
+
+    _write_json(os.path.join(index_dir, 'lexicon.json'), lexicon)
+    _write_json(os.path.join(index_dir, 'meta.json'), {
+        'version': INDEX_VERSION,
+        'profile': profile,
+        'documents': [str(name) for name in doc_df.index],
+        'paths': [str(path) for path in doc_df['policy_doc_paths']],
+        'lengths': doc_lengths,
+    })
+
+
+class CorpusIndex:
+    """Queries a positional inverted index written by build_corpus_index
+
+    Query strings are tokenized, lemmatized and filtered like the indexed
+    documents. Results are keyed by document name (the index of the document
+    table the index was built from).
+
+    Example:
+        index = CorpusIndex('../cache/corpus_index')
+        index.term_frequencies(['resilience', 'drought'])
+        index.phrase_query('early warning systems')
+        index.proximity_query('early warning systems', 'food security', window=50)
+
+    Args:
+        index_dir (str): folder of the index
+    """
+
+    def __init__(self, index_dir: str) -> None:
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != INDEX_VERSION:
+            raise ValueError(f"{index_dir} holds an index of version {meta['version']}, "
+                             f"expected {INDEX_VERSION}; rebuild it with build_corpus_index")
+        with open(os.path.join(index_dir, 'lexicon.json')) as f:
+            self.lexicon: Dict[str, List[int]] = json.load(f)
+        self.profile = meta['profile']
+        self.documents: List[str] = meta['documents']
+        self.paths: List[str] = meta['paths']
+        self.lengths: List[int] = meta['lengths']
+        postings_path = os.path.join(index_dir, 'postings.bin')
+        if os.path.getsize(postings_path) > 0:
+            self.postings = np.memmap(postings_path, dtype=np.uint8, mode='r')
+        else:
+            self.postings = np.zeros(0, dtype=np.uint8)
+
+    def normalize(self, text: str) -> List[str]:
+        """Turns a query into the terms of the index.
+
+        Args:
+            text (str): a word or phrase
+
+        Returns (List[str]):
+            its filtered lowercase lemmas
+        """
+        with pipeline_profile(self.profile) as nlp:
+            tokens = nlp(contraction_expander.expand(text))
+        filtered_tokens, _ = filter_token_array(tokens)
+        return [token.text for token in filtered_tokens]
+
+    def postings_of(self, term: str) -> Dict[int, np.ndarray]:
+        """Decodes the posting list of an index term.
+
+        Args:
+            term (str): an index term (already normalized)
+
+        Returns (Dict[int, np.ndarray]):
+            the sorted positions of the term in every document id it occurs in
+        """
+        if term not in self.lexicon:
+            return {}
+        offset, size, n_docs, _ = self.lexicon[term]
+        values = varbyte_decode(self.postings[offset:offset + size])
+        doc_ids = np.cumsum(values[:n_docs])
+        frequencies = values[n_docs:2 * n_docs]
+        positions = np.cumsum(values[2 * n_docs:])
+        # undo the running sum across documents
+        doc_starts = np.cumsum(frequencies) - frequencies
+        positions -= np.repeat(positions[doc_starts] - values[2 * n_docs:][doc_starts], frequencies)
+        return {int(doc_id): positions[start:start + frequency]
+                for doc_id, start, frequency in zip(doc_ids, doc_starts, frequencies)}
+
+    def _phrase_positions(self, terms: List[str]) -> Dict[int, np.ndarray]:
+        """Finds the start positions of a sequence of index terms in every document."""
+        if not terms:
+            return {}
+        matches = self.postings_of(terms[0])
+        for k, term in enumerate(terms[1:], start=1):
+            if not matches:
+                break
+            term_postings = self.postings_of(term)
+            matches = {doc_id: np.intersect1d(starts, term_postings[doc_id] - k, assume_unique=True)
+                       for doc_id, starts in matches.items() if doc_id in term_postings}
+            matches = {doc_id: starts for doc_id, starts in matches.items() if len(starts)}
+        return matches
+
+    def term_query(self, term: str) -> Dict[str, int]:
+        """Counts a single word in every document.
+
+        Args:
+            term (str): the word to count
+
+        Returns (Dict[str, int]):
+            its frequency in every document it occurs in
+        """
+        return self.phrase_counts(term)
+
+    def phrase_query(self, phrase: str) -> Dict[str, np.ndarray]:
+        """Finds a phrase in every document.
+
+        Args:
+            phrase (str): words that have to follow each other
+
+        Returns (Dict[str, np.ndarray]):
+            the start positions of the phrase in every document it occurs in
+        """
+        matches = self._phrase_positions(self.normalize(phrase))
+        return {self.documents[doc_id]: starts for doc_id, starts in sorted(matches.items())}
+
+    def phrase_counts(self, phrase: str) -> Dict[str, int]:
+        """Counts a phrase in every document, see phrase_query."""
+        return {document: len(starts) for document, starts in self.phrase_query(phrase).items()}
+
+    def proximity_query(self, first: str, second: str, window: int) -> Dict[str, np.ndarray]:
+        """Finds two phrases starting at most window positions apart.
+
+        Args:
+            first (str): first phrase
+            second (str): second phrase, before or after the first one
+            window (int): maximum distance of the phrase starts in (filtered) tokens
+
+        Returns (Dict[str, np.ndarray]):
+            the start positions of the first phrase with the second phrase in
+            reach, in every document where there are any
+        """
+        first_matches = self._phrase_positions(self.normalize(first))
+        second_matches = self._phrase_positions(self.normalize(second))
+        results = {}
+        for doc_id in sorted(first_matches.keys() & second_matches.keys()):
+            starts, others = first_matches[doc_id], second_matches[doc_id]
+            n_near = (np.searchsorted(others, starts + window, side='right') -
+                      np.searchsorted(others, starts - window, side='left'))
+            if np.any(n_near > 0):
+                results[self.documents[doc_id]] = starts[n_near > 0]
+        return results
+
+    def term_frequencies(self, terms: List[str], document: Optional[str] = None) -> Dict[str, int]:
+        """Counts index terms in a document or in the whole corpus.
+
+        Terms are looked up as they are, e.g. the keywords returned by
+        nlppreprocess.make_filtered_tokens_from_ndc.
+
+        Args:
+            terms (List[str]): index terms
+            document (Optional[str]): document name, the whole corpus if None
+
+        Returns (Dict[str, int]):
+            the frequency of every term, 0 for terms that do not occur
+        """
+        if document is None:
+            return {term: self.lexicon[term][3] if term in self.lexicon else 0 for term in terms}
+        doc_id = self.documents.index(document)
+        return {term: len(self.postings_of(term).get(doc_id, ())) for term in terms}
+
+    def topic_frequency_subset(self, topic_to_keywords: Dict[str, List[str]], topic: str,
+                               document: Optional[str] = None) -> Dict[str, int]:
+        """Frequency table of the keywords of a topic, as nlpanalysis.calculate_topic_frequency_subset.
+
+        Args:
+            topic_to_keywords (Dict[str, List[str]]): a mapping of all topics to their (processed) keywords
+            topic (str): the topic for which to find keyword frequencies
+            document (Optional[str]): document name, the whole corpus if None
+
+        Returns (Dict[str, int]):
+            the frequency of every keyword of the topic
+        """
+        return self.term_frequencies(topic_to_keywords[topic], document)
+
+    def document_frequencies(self) -> Dict[str, int]:
+        """Number of documents every index term occurs in."""
+        return {term: entry[2] for term, entry in self.lexicon.items()}
@@ -0,0 +1,280 @@
+"""Resumable batch runner for a whole corpus
+
+Processes the documents of read_docs_to_df in a pool of worker processes
+instead of a serial loop. Every worker loads the spacy model and the keyword
+matcher once, when it starts. Documents are handed out one at a time,
+largest first, so a big document picked up at the end does not keep the
+whole run waiting. The result of each document is written to its own
+checkpoint file as soon as it is done: a run that is interrupted (crash,
+kernel restart, Ctrl-C) skips the documents with a checkpoint when it is
+started again.
+
+The documents are ordered by path, so --start and --stop select the same
+documents on every machine; several machines can share a large country
+collection by processing disjoint index ranges into the same (or later
+merged) checkpoint folder. With --skip-duplicates only one document of every
+group of near duplicates is processed (see near_duplicates), and the index
+ranges count the remaining documents.
+
+    python corpus_runner.py ../test_resources/data ../results/south_africa --processes 4
+    python corpus_runner.py ../data/brazil ../results/brazil --start 0 --stop 500
+    python corpus_runner.py ../data/brazil ../results/brazil --start 500 --stop 1000
+
+The default per-document step counts the ontology and NDC keyword hits per
+topic and keyword in the preprocessed text; run_corpus takes any other
+module-level function of a document path.
+"""
+
+import argparse
+import glob
+import hashlib
+import multiprocessing
+import os
+import time
+import traceback
+import pandas as pd
+from typing import Callable, Dict, List, Optional, Tuple
+from datahelper import read_docs_to_df
+
+NDC_KEYWORD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ndc_keywords')
+
+# state of a worker process, set by _init_worker
+_worker: Dict[str, object] = {}
+
+
+def keyword_topic_counts(doc_path: str, max_word_length: int = 25) -> pd.DataFrame:
+    """Counts the keyword hits of a document per topic and keyword.
+
+    The document is preprocessed as in the corpus notebook (words longer than
+    max_word_length are dropped) and searched with the worker's keyword
+    matcher.
+
+    Args:
+        doc_path (str): path to the input document
+        max_word_length (int): longest word kept in the document text
+
+    Returns (pd.DataFrame):
+        the columns topic, keyword and count
+    """
+    from nlppreprocess import preprocess_doc
+    tokens, _, _ = preprocess_doc(doc_path)
+    document_text = ' '.join([token.text for token in tokens if len(token.text) <= max_word_length])
+    hits = _worker['matcher'].find_df(document_text)
+    return hits.groupby(['topic', 'keyword']).size().rename('count').reset_index()
+
+
+def _init_worker(ndc_paths: List[str], preload_models: bool) -> None:
+    from keyword_matcher import KeywordMatcher
+    from model_registry import preload
+    from nlppreprocess import SPACY_MODEL
+    _worker['matcher'] = KeywordMatcher.from_files(ndc_paths=ndc_paths)
+    if preload_models:
+        preload(spacy_models=[SPACY_MODEL])
+
+
+def _resolve_ndc_paths(ndc_paths: Optional[List[str]]) -> List[str]:
+    if ndc_paths is None:
+        return sorted(glob.glob(os.path.join(NDC_KEYWORD_DIR, '*.json')))
+    return ndc_paths
+
+
+def step_key(process_doc: Callable[[str], pd.DataFrame], ndc_paths: List[str]) -> str:
+    """Identifies a per-document step and its configuration.
+
+    The key changes whenever another function processes the documents or the
+    content of the ontology or any NDC keyword file of the keyword matcher
+    changes, so checkpoints of an earlier configuration are not reused.
+
+    Args:
+        process_doc (Callable[[str], pd.DataFrame]): computes the result rows of a document
+        ndc_paths (List[str]): NDC keyword files of the keyword matcher
+
+    Returns (str):
+        hexadecimal digest identifying the step
+    """
+    from keyword_matcher import ONTOLOGY_PATH
+    digest = hashlib.sha1(f"{process_doc.__module__}.{process_doc.__qualname__}".encode('utf-8'))
+    for keyword_path in [ONTOLOGY_PATH] + list(ndc_paths):
+        with open(keyword_path, 'rb') as f:
+            digest.update(hashlib.sha1(f.read()).digest())
+    return digest.hexdigest()
+
+
+def checkpoint_path(checkpoint_dir: str, doc_path: str, step: str) -> str:
+    """Returns the checkpoint file of a document processed by a step.
+
+    The checkpoint is named after the content of the document and the step
+    (see step_key), so a changed document or step is processed again, and
+    machines with different paths to the same documents share checkpoints.
+
+    Args:
+        checkpoint_dir (str): folder of the checkpoints
+        doc_path (str): path to the input document
+        step (str): key of the per-document step, see step_key
+
+    Returns (str):
+        path of the pickled results of the document
+    """
+    with open(doc_path, 'rb') as f:
+        digest = hashlib.sha1(f.read())
+    digest.update(step.encode('utf-8'))
+    return os.path.join(checkpoint_dir, digest.hexdigest()[:20] + '.pkl')
+
+
+def _run_document(task: Tuple[Callable[[str], pd.DataFrame], str, str]) -> Tuple[str, Optional[int], float, Optional[str]]:
+    process_doc, doc_path, path = task
+    start = time.perf_counter()
+    try:
+        results = process_doc(doc_path)
+    except Exception:
+        return doc_path, None, time.perf_counter() - start, traceback.format_exc()
+    results.to_pickle(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return doc_path, len(results), time.perf_counter() - start, None
+
+
+def select_shard(doc_df: pd.DataFrame, start: int = 0, stop: Optional[int] = None) -> pd.DataFrame:
+    """Orders the documents by path and selects an index range of them.
+
+    Args:
+        doc_df (pd.DataFrame): document table as returned by datahelper.read_docs_to_df
+        start (int): position of the first document of the shard
+        stop (Optional[int]): position after the last document of the shard, None for the end
+
+    Returns (pd.DataFrame):
+        the documents of the shard
+    """
+    return doc_df.sort_values('policy_doc_paths').iloc[start:stop]
+
+
+def run_corpus(doc_df: pd.DataFrame,
+               checkpoint_dir: str,
+               process_doc: Callable[[str], pd.DataFrame] = keyword_topic_counts,
+               processes: int = 1,
+               ndc_paths: Optional[List[str]] = None,
+               preload_models: bool = True) -> List[str]:
+    """Processes the documents without a checkpoint, largest first, in a process pool.
+
+    Example:
+        policy_doc_df = read_docs_to_df('../test_resources/data')
+        failed = run_corpus(policy_doc_df, '../results/checkpoints', processes=4)
+        results = collect_results(policy_doc_df, '../results/checkpoints')
+
+    Checkpoints are only reused for the same document content, process_doc
+    and keyword files (see checkpoint_path).
+
+    Args:
+        doc_df (pd.DataFrame): document table as returned by datahelper.read_docs_to_df
+        checkpoint_dir (str): folder of the per-document checkpoints
+        process_doc (Callable[[str], pd.DataFrame]): computes the result rows of a
+            document, a module-level function so the workers can unpickle it
+        processes (int): number of worker processes, 1 runs in this process
+        ndc_paths (Optional[List[str]]): NDC keyword files of the keyword matcher,
+            all files of ndc_keywords if None
+        preload_models (bool): load the spacy model when a worker starts
+
+    Returns (List[str]):
+        paths of the documents that failed, their tracebacks are printed
+    """
+    ndc_paths = _resolve_ndc_paths(ndc_paths)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    step = step_key(process_doc, ndc_paths)
+    doc_paths = list(doc_df['policy_doc_paths'])
+    paths = {doc_path: checkpoint_path(checkpoint_dir, doc_path, step) for doc_path in doc_paths}
+    todo = [doc_path for doc_path in doc_paths if not os.path.exists(paths[doc_path])]
+    todo.sort(key=os.path.getsize, reverse=True)
+    print(f"{len(doc_paths) - len(todo)} of {len(doc_paths)} documents already done, "
+          f"processing {len(todo)} with {processes} processes")
+
+    tasks = [(process_doc, doc_path, paths[doc_path]) for doc_path in todo]
+    failed = []
+    start = time.perf_counter()
+    if processes > 1:
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(processes, initializer=_init_worker, initargs=(ndc_paths, preload_models))
+        # chunksize 1 keeps the largest-first order across the workers
+        outcomes = pool.imap_unordered(_run_document, tasks, chunksize=1)
+    else:
+        pool = None
+        _init_worker(ndc_paths, preload_models)
+        outcomes = map(_run_document, tasks)
+    try:
+        for done, (doc_path, n_rows, seconds, error) in enumerate(outcomes, 1):
+            if error is not None:
+                failed.append(doc_path)
+                print(f"[{done}/{len(todo)}] FAILED {doc_path}:\n{error}")
+            else:
+                print(f"[{done}/{len(todo)}] {doc_path}: {n_rows} rows in {seconds:.1f}s")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    print(f"Processed {len(todo) - len(failed)} documents in {time.perf_counter() - start:.1f}s, "
+          f"{len(failed)} failed")
+    return failed
+
+
+def collect_results(doc_df: pd.DataFrame,
+                    checkpoint_dir: str,
+                    process_doc: Callable[[str], pd.DataFrame] = keyword_topic_counts,
+                    ndc_paths: Optional[List[str]] = None) -> pd.DataFrame:
+    """Combines the checkpoints of the documents into one table.
+
+    Args:
+        doc_df (pd.DataFrame): document table as returned by datahelper.read_docs_to_df
+        checkpoint_dir (str): folder of the per-document checkpoints
+        process_doc (Callable[[str], pd.DataFrame]): the step the checkpoints were written by
+        ndc_paths (Optional[List[str]]): NDC keyword files of the run,
+            all files of ndc_keywords if None
+
+    Returns (pd.DataFrame):
+        the result rows of every document with a checkpoint, with a
+        'policy_doc_paths' column
+    """
+    step = step_key(process_doc, _resolve_ndc_paths(ndc_paths))
+    results = []
+    for doc_path in doc_df['policy_doc_paths']:
+        path = checkpoint_path(checkpoint_dir, doc_path, step)
+        if os.path.exists(path):
+            doc_results = pd.read_pickle(path)
+            doc_results.insert(0, 'policy_doc_paths', doc_path)
+            results.append(doc_results)
+    if not results:
+        return pd.DataFrame(columns=['policy_doc_paths'])
+    return pd.concat(results, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('folder_path', help='folder of the corpus documents')
+    parser.add_argument('output_dir', help='folder of the checkpoints and the results')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--start', type=int, default=0, help='position of the first document of the shard')
+    parser.add_argument('--stop', type=int, help='position after the last document of the shard')
+    parser.add_argument('--ndc-keywords', nargs='+',
+                        help='NDC keyword json files, all files of ndc_keywords by default')
+    parser.add_argument('--skip-duplicates', action='store_true',
+                        help='only process one document of every group of near duplicates')
+    args = parser.parse_args()
+
+    doc_df = read_docs_to_df(args.folder_path, find_duplicates=args.skip_duplicates)
+    if args.skip_duplicates:
+        print(f"Skipping {(~doc_df['is_canonical']).sum()} near-duplicate documents")
+        doc_df = doc_df[doc_df['is_canonical']]
+    doc_df = select_shard(doc_df, args.start, args.stop)
+    checkpoint_dir = os.path.join(args.output_dir, 'checkpoints')
+    failed = run_corpus(doc_df, checkpoint_dir, processes=args.processes, ndc_paths=args.ndc_keywords)
+    if failed:
+        print("Run the same command again to retry the failed documents")
+        raise SystemExit(1)
+
+    stop = args.start + len(doc_df)
+    results_path = os.path.join(args.output_dir, f'results_{args.start}-{stop}.pkl')
+    collect_results(doc_df, checkpoint_dir, ndc_paths=args.ndc_keywords).to_pickle(results_path)
+    print(f"Results of documents {args.start} to {stop} written to {results_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,116 @@
+import os
 import spacy
-import tensorflow_hub as hub
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 import numpy as np
+from spacy.attrs import ORTH
+from spacy.strings import hash_string
 from spacy.tokens import Doc, Token, Span
 from spacy.language import Language
+import instrumentation
+from embedding_cache import EmbeddingCache
+from encoders import MODEL_URL, SentenceEncoder, get_sentence_encoder
+from model_registry import get_encoder
 
-# Could put this URL in a configuration file, or load from environment variables
-MODEL_URL = "https://tfhub.dev/google/universal-sentence-encoder/4"
+# Folder of the persistent embedding cache, embeddings are only cached in memory if unset
+EMBEDDING_CACHE_DIR = os.environ.get("GIZ_EMBEDDING_CACHE_DIR")
 
-EMBEDDER = hub.load(MODEL_URL)
+_EMBEDDING_CACHES: Dict[str, EmbeddingCache] = {}
+
+_LEXEME_SCORE_TABLES: Dict[Tuple[str, Tuple[str, ...]], "LexemeScoreTable"] = {}
+
+
+def __getattr__(name):
+    # EMBEDDER used to be loaded on import, it now comes from the model registry
+    if name == "EMBEDDER":
+        return get_encoder(MODEL_URL)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_embedding_cache(encoder: Union[str, SentenceEncoder] = MODEL_URL) -> EmbeddingCache:
+    """Returns the embedding cache shared by everything embedding with an encoder.
+
+    A model behind the encoder is only loaded (through the model registry) once
+    an embedding is not found in the cache. Hit and miss counters are available
+    through get_embedding_cache().stats().
+
+    Args:
+        encoder (Union[str, SentenceEncoder]): sentence encoder or its
+            specification, see encoders.get_sentence_encoder
+
+    Returns (EmbeddingCache):
+        the cached embedding function of the encoder
+    """
+    encoder = get_sentence_encoder(encoder)
+    if encoder.model_id not in _EMBEDDING_CACHES:
+        _EMBEDDING_CACHES[encoder.model_id] = EmbeddingCache(encoder.model_id,
+                                                             encoder,
+                                                             cache_dir=EMBEDDING_CACHE_DIR)
+    return _EMBEDDING_CACHES[encoder.model_id]
+
+
+# Orders in which resolve_entities considers overlapping candidates. Candidates
+# are (start, end, label, score) tuples; ties fall back to document order.
+OVERLAP_POLICIES = {
+    # most correlated span first, longer spans win ties
+    "score": lambda c: (-c[3], -(c[1] - c[0]), c[0]),
+    # longest span first, more correlated spans win ties
+    "longest": lambda c: (-(c[1] - c[0]), -c[3], c[0]),
+    # in the order given, as when spans were appended to doc.ents one by one
+    "first": None,
+}
+
+
+def resolve_entities(doc: Doc,
+                     candidates: List[Tuple[int, int, str, float]],
+                     policy: str = "score") -> int:
+    """Adds a non-overlapping selection of candidate spans to the document entities
+
+    There can only be one entity attached to each token, so the candidates are
+    visited in the order of the overlap policy (see OVERLAP_POLICIES) and a
+    candidate is kept only if none of its tokens is taken yet, by an entity
+    already in the document or by a previously kept candidate. Token occupancy
+    is tracked in an array, so this takes near-linear time, and doc.ents is
+    assigned only once. Empty spans are ignored.
+
+    Example:
+        dropped = resolve_entities(doc, [(3, 5, "CLIMATE", 0.8), (4, 6, "CLIMATE", 0.9)])
+
+    Args:
+        doc (Doc): A spacy document that is being analyzed
+        candidates (List[Tuple[int, int, str, float]]): start and end token
+            index, label and score of every candidate span
+        policy (str): key of OVERLAP_POLICIES deciding which overlapping candidate wins
+
+    Return:
+        dropped (int): number of candidates dropped because of an overlap
+    """
+    if policy not in OVERLAP_POLICIES:
+        raise ValueError(f"Unknown overlap policy '{policy}', "
+                         f"choose one of {list(OVERLAP_POLICIES)}")
+
+    occupied = np.zeros(len(doc), dtype=bool)
+    for ent in doc.ents:
+        occupied[ent.start:ent.end] = True
+
+    candidates = [c for c in candidates if c[0] < c[1]]
+    if OVERLAP_POLICIES[policy] is not None:
+        candidates = sorted(candidates, key=OVERLAP_POLICIES[policy])
+
+    accepted = []
+    dropped = 0
+    with instrumentation.timer('resolve_entities'):
+        for start, end, label, _ in candidates:
+            if occupied[start:end].any():
+                dropped += 1
+                continue
+            occupied[start:end] = True
+            accepted.append(Span(doc, start, end, label=label))
+
+        if accepted:
+            doc.ents = list(doc.ents) + accepted
+    instrumentation.count('entities_added', len(accepted))
+    instrumentation.count('overlap_rejections', dropped)
+    return dropped
 
 
 class TokenArrayCorrelator:
@@ -22,13 +124,17 @@ class TokenArrayCorrelator:
         keywords (str): A list of keywords in a subject area
         threshold (float): Embedding-similarity threshold to tag entity
         entity_tag (str): A name given to a section that will appear in Displacy
+        overlap_policy (str): Which of overlapping passages is tagged (see OVERLAP_POLICIES)
+        encoder (Union[str, SentenceEncoder]): sentence encoder, the Universal Sentence Encoder if None
     """
 
     def __init__(self, keywords: List[str], threshold: float,
-                 entity_tag: str) -> None:
+                 entity_tag: str, overlap_policy: str = "score",
+                 encoder: Optional[Union[str, SentenceEncoder]] = None) -> None:
         self.threshold = threshold
         self.entity_tag = entity_tag
-        self.correlator = KeywordCorrelator(keywords)
+        self.overlap_policy = overlap_policy
+        self.correlator = KeywordCorrelator(keywords, encoder=encoder)
 
     def __call__(self, doc: Doc, tokens: List[List[Token]]):
         """Correlates and tags a section of a document with the loaded keywords
@@ -38,7 +144,8 @@ class TokenArrayCorrelator:
         the similarity is higher than a certain threshold, the subset starting from the
         index of the first token to the index of the last token will be added to the 
         document entities if it does not overlap with an existing entity. This 
-        entitly will be labeled with the self.entity_tag variable
+        entitly will be labeled with the self.entity_tag variable. Overlapping
+        passages are resolved by resolve_entities with self.overlap_policy
 
         This is especially useful if performing preprocessing on a document
         where some tokens out of a given subset may be thrown out as
@@ -52,17 +159,19 @@ class TokenArrayCorrelator:
         Args:
             doc (Doc): The current working spacy document
             tokens (List[List[Token]]): A subset of passages (token elections) from the doc
+
+        Return:
+            dropped (int): number of passages over the threshold dropped because of an overlap
         """
         passage_positions = [(passage[0].i, passage[-1].i) for passage in tokens]
         joined_passages = [" ".join([str(t) for t in passage]) for passage in tokens]
         scored_passages = self.correlator(joined_passages)
-        for score, position in zip(scored_passages, passage_positions):
-            if score > self.threshold:
-                try:
-                    doc.ents = list(
-                        doc.ents) + [Span(doc, position[0], position[1], self.entity_tag)]
-                except:
-                    pass
+        candidates = [
+            (position[0], position[1], self.entity_tag, score)
+            for score, position in zip(scored_passages, passage_positions)
+            if score > self.threshold
+        ]
+        return resolve_entities(doc, candidates, self.overlap_policy)
 
 
 class SpanCorrelator:
@@ -79,12 +188,17 @@ class SpanCorrelator:
         keywords (List[str]): list of subject keywords
         threshold (float): correlation threshold for a span to be labeled
         entity_tag (str): label for the span, will appear in displacy plot  
+        overlap_policy (str): which of overlapping spans is labeled (see OVERLAP_POLICIES)
+        encoder (Union[str, SentenceEncoder]): sentence encoder, the Universal Sentence Encoder if None
     """
 
-    def __init__(self, keywords: List[str], threshold: float, entity_tag: str):
+    def __init__(self, keywords: List[str], threshold: float, entity_tag: str,
+                 overlap_policy: str = "score",
+                 encoder: Optional[Union[str, SentenceEncoder]] = None):
         self.threshold = threshold
         self.entity_tag = entity_tag
-        self.correlator = KeywordCorrelator(keywords)
+        self.overlap_policy = overlap_policy
+        self.correlator = KeywordCorrelator(keywords, encoder=encoder)
 
     def __call__(self, doc: Doc, spans: List[Span]):
         """Tags a span if over correlation thresh to initialized set of keywords
@@ -98,31 +212,39 @@ class SpanCorrelator:
         Args:
             doc (Doc): A spacy document that is being analyzed
             span (Span): A consecutive subset of the document
-        
+
+        Return:
+            dropped (int): number of spans over the threshold dropped because of an overlap
         """
         text = [span.text for span in spans]
         correlated = self.correlator(text)
+        return self.tag_spans(doc, spans, correlated)
 
-        for span, score in zip(spans, correlated):
-            if score > self.threshold:
-                try:
-                    doc.ents = list(doc.ents) + [
-                        Span(doc, span.start, span.end, self.entity_tag)
-                    ]
-                except:
-                    pass
+    def tag_spans(self, doc: Doc, spans: List[Span], scores: List[float]):
+        """Tags the spans whose precomputed correlation is over the threshold
+
+        Args:
+            doc (Doc): A spacy document that is being analyzed
+            spans (List[Span]): Consecutive subsets of the document
+            scores (List[float]): Correlation of every span to the keywords
+
+        Return:
+            dropped (int): number of spans over the threshold dropped because of an overlap
+        """
+        candidates = [(span.start, span.end, self.entity_tag, score)
+                      for span, score in zip(spans, scores)
+                      if score > self.threshold]
+        return resolve_entities(doc, candidates, self.overlap_policy)
 
 
 def entity_correlation_tagger(doc, spans: List, threshold, corr_attr_key,
-                              entity_tag):
-    spans = [s for s in spans if s._.get(corr_attr_key) > threshold]
+                              entity_tag, overlap_policy="score") -> int:
+    candidates = [(s.start, s.end, entity_tag, s._.get(corr_attr_key))
+                  for s in spans]
+    candidates = [c for c in candidates if c[3] > threshold]
 
-    for s in spans:
-        try:
-            doc.ents = list(
-                doc.ents) + [Span(doc, s.start, s.end, label=entity_tag)]
-        except:  # This case is hit if there are overlapping entities, there can only be one entity attached to each token at a time.
-            pass
+    # there can only be one entity attached to each token at a time, overlaps are dropped
+    return resolve_entities(doc, candidates, overlap_policy)
 
 
 class KeywordCorrelator:
@@ -130,25 +252,35 @@ class KeywordCorrelator:
     A helper class to correlate strings with a given set of keywords
 
     This class is initialized with a set of keywords which are embedded
-    in a tensorflow model loaded from the URL defined by MODEL_URL
+    with a sentence encoder, by default the tensorflow model loaded from
+    the URL defined by MODEL_URL. Offline encoders are available through
+    encoders.get_sentence_encoder, e.g. "hashed-ngram". All embeddings go
+    through the shared embedding cache of the encoder, so a text is only
+    embedded once across instances, calls and (with GIZ_EMBEDDING_CACHE_DIR
+    set) sessions
 
     Repeated calls can be made to the instance that embed a list of 
     strings and return corresponding correlation coefficients
 
     Example: 
         climate_correlator = KeywordCorrelator(climate_kwds)
+        offline_correlator = KeywordCorrelator(climate_kwds, encoder="hashed-ngram")
 
     Args:
         keywords (List[str]): list of keyword phrases to embed
+        encoder (Union[str, SentenceEncoder]): sentence encoder or its
+            specification, the Universal Sentence Encoder if None
     """
 
-    def __init__(self, keywords: List[str]) -> None:
-        self.embed = EMBEDDER
+    def __init__(self, keywords: List[str],
+                 encoder: Optional[Union[str, SentenceEncoder]] = None) -> None:
+        self.embed = get_embedding_cache(MODEL_URL if encoder is None else encoder)
         self.keywords = keywords
         self.keyword_embeddings = self.embed(self.keywords)
 
     @classmethod
-    def add_span_subject_correlator(cls, tag_name: str, keywords: List[str]):
+    def add_span_subject_correlator(cls, tag_name: str, keywords: List[str],
+                                    encoder: Optional[Union[str, SentenceEncoder]] = None):
         """Special method to add a keyword correlator feature to any 
         span selected from a document.
 
@@ -166,9 +298,10 @@ class KeywordCorrelator:
         Args:
             tag_name (str): desired name of callable extension
             keywords (List[str]): List of keywords to correlate on extension
+            encoder (Union[str, SentenceEncoder]): sentence encoder, the Universal Sentence Encoder if None
         
         """
-        correlator = KeywordCorrelator(keywords)
+        correlator = KeywordCorrelator(keywords, encoder=encoder)
         correlator_getter = lambda span: correlator([span.text])[0]
         Span.set_extension(tag_name, getter=correlator_getter, force=True)
 
@@ -195,6 +328,187 @@ class KeywordCorrelator:
         return correlation_1d
 
 
+class MultiTopicCorrelator:
+    """Correlates strings with the keywords of many topics at once
+
+    The keyword embeddings of all topics are stacked into one matrix, topic
+    after topic, so every input is embedded once and correlated with all
+    keywords in a single matrix product. The maximum per topic is then taken
+    with one segmented reduction (np.maximum.reduceat) over the topic
+    boundaries. The scores are those of one KeywordCorrelator per topic, e.g.
+    for all SDG classes of the ontology or all topics of an NDC keyword file,
+    without embedding each input once per topic. They are equal up to float32
+    rounding: depending on the BLAS library, a product of differently shaped
+    matrices may round the last bit differently.
+
+    The inputs are embedded in one call, as in KeywordCorrelator; only the
+    matrix product is computed in chunks of inputs, so the correlation matrix
+    of a chunk stays within memory_budget_mb even for the full ontology.
+
+    Example:
+        correlator = MultiTopicCorrelator(ndc_south_africa)
+        scores = correlator(["early warning systems for floods"])
+        scores[0, correlator.topics.index("early warning")]
+
+    Args:
+        topic_to_keywords (Dict[str, List[str]]): a mapping of all topics to their relevant keywords
+        encoder (Union[str, SentenceEncoder]): sentence encoder, the Universal Sentence Encoder if None
+        memory_budget_mb (float): approximate memory of the correlation matrix of a chunk of inputs
+    """
+
+    def __init__(self, topic_to_keywords: Dict[str, List[str]],
+                 encoder: Optional[Union[str, SentenceEncoder]] = None,
+                 memory_budget_mb: float = 64) -> None:
+        empty_topics = [topic for topic, keywords in topic_to_keywords.items() if not keywords]
+        if empty_topics:
+            raise ValueError(f"Topics without keywords: {empty_topics}")
+
+        self.embed = get_embedding_cache(MODEL_URL if encoder is None else encoder)
+        self.topics = list(topic_to_keywords)
+        self.keywords = [k for keywords in topic_to_keywords.values() for k in keywords]
+        # index of the first keyword of every topic in the stacked keyword matrix
+        topic_sizes = [len(keywords) for keywords in topic_to_keywords.values()]
+        self.topic_starts = np.cumsum([0] + topic_sizes[:-1])
+        self.keyword_embeddings = self.embed(self.keywords)
+        # a column of the correlation matrix per input
+        bytes_per_input = 4 * len(self.keywords)
+        self.chunk_size = max(1, int(memory_budget_mb * 1024 * 1024 / bytes_per_input))
+
+    def __call__(self, span: List[str]) -> np.ndarray:
+        """Computes the correlation of phrases to the keywords of every topic
+
+        Args:
+            span (List[str]): A list of phrases to correlate
+
+        Returns (np.ndarray):
+            array of shape (number of phrases, number of topics) with the
+            highest correlation of every phrase to a keyword of every topic,
+            topics in the order of self.topics
+        """
+        input_embeddings = self.embed(span)
+        correlations = np.zeros((len(span), len(self.topics)), dtype=np.float32)
+        for start in range(0, len(span), self.chunk_size):
+            correlation_2d = np.inner(self.keyword_embeddings,
+                                      input_embeddings[start:start + self.chunk_size])
+            correlations[start:start + correlation_2d.shape[1]] = np.maximum.reduceat(
+                correlation_2d, self.topic_starts, axis=0).T
+        return correlations
+
+
+class LexemeScoreTable:
+    """Keyword correlations of word forms, keyed by their spacy orth hash
+
+    Token-level correlation only depends on the form of a token, so every
+    distinct form (Lexeme.orth) is embedded and correlated once and its score
+    is kept in a table shared by all documents (and, through
+    get_lexeme_score_table, all pipeline components) correlating with the same
+    encoder and keywords. The table holds the orth hashes in sorted order and
+    their scores in a compact float16 array (about 3 significant digits);
+    scores of a whole document are looked up with np.searchsorted and one
+    gather.
+
+    Example:
+        table = get_lexeme_score_table("hashed-ngram", climate_kwds)
+        scores = table.lookup(doc.to_array(ORTH), doc.vocab.strings)
+
+    Args:
+        keywords (List[str]): list of keyword phrases to correlate with
+        encoder (Union[str, SentenceEncoder]): sentence encoder, the Universal Sentence Encoder if None
+    """
+
+    def __init__(self, keywords: List[str],
+                 encoder: Optional[Union[str, SentenceEncoder]] = None) -> None:
+        self.correlator = KeywordCorrelator(keywords, encoder=encoder)
+        self.orths = np.zeros(0, dtype=np.uint64)
+        self.scores = np.zeros(0, dtype=np.float16)
+
+    def __len__(self) -> int:
+        return len(self.orths)
+
+    def _rows(self, orths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rows = np.searchsorted(self.orths, orths)
+        found = rows < len(self.orths)
+        found[found] = self.orths[rows[found]] == orths[found]
+        return rows, found
+
+    def add(self, orths: np.ndarray, strings) -> None:
+        """Scores the word forms missing from the table.
+
+        Args:
+            orths (np.ndarray): orth hashes of the word forms
+            strings: maps an orth hash to its text, e.g. the StringStore of the vocab
+        """
+        orths = np.unique(np.asarray(orths, dtype=np.uint64))
+        _, found = self._rows(orths)
+        missing = orths[~found]
+        if not len(missing):
+            return
+        scores = self.correlator([strings[int(orth)] for orth in missing])
+        orths = np.concatenate([self.orths, missing])
+        order = np.argsort(orths, kind='stable')
+        self.orths = orths[order]
+        self.scores = np.concatenate([self.scores, np.asarray(scores, dtype=np.float16)])[order]
+
+    def lookup(self, orths: np.ndarray, strings) -> np.ndarray:
+        """Returns the scores of word forms, scoring the ones missing from the table first.
+
+        Args:
+            orths (np.ndarray): orth hashes of the word forms, e.g. doc.to_array(ORTH)
+            strings: maps an orth hash to its text, e.g. the StringStore of the vocab
+
+        Returns (np.ndarray):
+            float16 score of every word form
+        """
+        orths = np.asarray(orths, dtype=np.uint64)
+        rows, found = self._rows(orths)
+        if not found.all():
+            self.add(orths[~found], strings)
+            rows, _ = self._rows(orths)
+        return self.scores[rows]
+
+    def top_k(self, k: int, orths: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Finds the highest scored word forms without sorting the whole table.
+
+        Args:
+            k (int): number of word forms to return
+            orths (Optional[np.ndarray]): word forms to choose from (they have to
+                be in the table), all word forms of the table if None
+
+        Returns:
+            orths (np.ndarray): orth hashes of the k highest scored word forms, highest first
+            scores (np.ndarray): their scores
+        """
+        if orths is None:
+            orths, scores = self.orths, self.scores
+        else:
+            orths = np.unique(np.asarray(orths, dtype=np.uint64))
+            scores = self.scores[self._rows(orths)[0]]
+        k = min(k, len(orths))
+        if k == 0:
+            return orths[:0], scores[:0]
+        top = np.argpartition(-scores.astype(np.float32), k - 1)[:k]
+        top = top[np.argsort(-scores[top].astype(np.float32), kind='stable')]
+        return orths[top], scores[top]
+
+
+def get_lexeme_score_table(encoder: Union[str, SentenceEncoder], keywords: List[str]) -> LexemeScoreTable:
+    """Returns the lexeme score table shared by everything correlating with an encoder and keywords.
+
+    Args:
+        encoder (Union[str, SentenceEncoder]): sentence encoder or its
+            specification, see encoders.get_sentence_encoder
+        keywords (List[str]): list of keyword phrases to correlate with
+
+    Returns (LexemeScoreTable):
+        the table of the encoder and keywords
+    """
+    encoder = get_sentence_encoder(encoder)
+    key = (encoder.model_id, tuple(keywords))
+    if key not in _LEXEME_SCORE_TABLES:
+        _LEXEME_SCORE_TABLES[key] = LexemeScoreTable(list(keywords), encoder=encoder)
+    return _LEXEME_SCORE_TABLES[key]
+
+
 @Language.factory("kwd_correlate_factory")
 class KeywordCorrelateSpacy:
     """A class to assist in finding related terms to a set of keywords
@@ -215,18 +529,43 @@ class KeywordCorrelateSpacy:
     ex: doc[3]._.climate_change_corr will return the correlation of the fourth word
     in the document to the list of climate change keywords
 
+    Every distinct word form is embedded once: the scores come from the
+    LexemeScoreTable shared by all components with the same model and
+    keywords, and are stored as one float16 array per document
+    (doc._.<correlation_tag>_scores) that the token extension reads from and
+    writes to, so token._.set(correlation_tag, value) still works.
+
     Args:
-        tf_model: url to a tensorflow model that embeds sentences
+        tf_model: url to a tensorflow model that embeds sentences, or any other
+            sentence encoder specification, e.g. "hashed-ngram" to run offline
+            (see encoders.get_sentence_encoder)
         keywords: a list of keywords to relate to
     """
 
     def __init__(self, nlp: Language, name: str, tf_model: str,
                  keywords: List[str], correlation_tag: str):
         self.keywords = keywords
-        self.embed = hub.load(tf_model)
-        self.keyword_embeddings = self.embed(self.keywords)
+        self.table = get_lexeme_score_table(tf_model, keywords)
         self.correlation_tag = correlation_tag
-        Token.set_extension(correlation_tag, default=None)
+        self.scores_attr = correlation_tag + "_scores"
+        Doc.set_extension(self.scores_attr, default=None, force=True)
+        scores_attr = self.scores_attr
+
+        def token_score(token):
+            scores = token.doc._.get(scores_attr)
+            if scores is None or np.isnan(scores[token.i]):
+                return None
+            return scores[token.i]
+
+        def set_token_score(token, value):
+            scores = token.doc._.get(scores_attr)
+            if scores is None:
+                # NaN marks the tokens without a score
+                scores = np.full(len(token.doc), np.nan, dtype=np.float16)
+                token.doc._.set(scores_attr, scores)
+            scores[token.i] = np.nan if value is None else value
+
+        Token.set_extension(correlation_tag, getter=token_score, setter=set_token_score, force=True)
 
     def correlate_tokens(self, tokens) -> List[Tuple[float, str]]:
         """Initiates the correlation process on a new document
@@ -239,24 +578,45 @@ class KeywordCorrelateSpacy:
             which may be optionally sorted, highest correlated terms first
         
         """
-        list_to_correlate = list(tokens)
-        input_embeddings = self.embed(list_to_correlate)
-        correlation_2d = np.inner(self.keyword_embeddings, input_embeddings)
-        correlation_1d = np.max(correlation_2d, axis=0)
+        list_to_correlate = [str(t) for t in tokens]
+        orths, strings = self._orths(list_to_correlate)
+        correlation_1d = self.table.lookup(orths, strings)
 
         return correlation_1d, list_to_correlate
 
-    def sorted_correlate(self, tokens):
-        correlation, list_out = self.correlate_tokens(tokens)
-        zipped_correlations = zip(correlation, list_out)
-        return sorted(zipped_correlations, key=lambda x: x[0], reverse=True)
+    @staticmethod
+    def _orths(texts: List[str]) -> Tuple[np.ndarray, Dict[int, str]]:
+        strings = {hash_string(text): text for text in dict.fromkeys(texts)}
+        orths = np.array([hash_string(text) for text in texts], dtype=np.uint64)
+        return orths, strings
 
-    def __call__(self, doc: Doc):
-        tokens = [str(t) for t in doc]
-        correlated, _ = self.correlate_tokens(tokens)
+    def sorted_correlate(self, tokens, k: Optional[int] = None) -> List[Tuple[float, str]]:
+        """Sorts tokens by their correlation to the keywords
 
-        for i, t in enumerate(doc):
-            t._.set(self.correlation_tag, correlated[i])
+        With k, the top k are selected with np.argpartition and only those k
+        are sorted.
+
+        Args:
+            tokens: a set of tokens (or strings) to sort
+            k (Optional[int]): number of tokens to return, all if None
+
+        Returns: a list of (correlation, token) tuples, one per token,
+            highest correlated first
+        """
+        tokens = list(tokens)
+        correlation, _ = self.correlate_tokens(tokens)
+        scores = -correlation.astype(np.float32)
+        if k is not None and k < len(tokens):
+            top = np.argpartition(scores, k - 1)[:k] if k > 0 else np.zeros(0, dtype=np.int64)
+            top = top[np.argsort(scores[top], kind='stable')]
+        else:
+            top = np.argsort(scores, kind='stable')
+        return [(float(correlation[i]), tokens[i]) for i in top]
+
+    def __call__(self, doc: Doc):
+        # one lookup and gather for the whole document
+        scores = self.table.lookup(doc.to_array(ORTH), doc.vocab.strings)
+        doc._.set(self.scores_attr, scores)
 
         return doc
 
@@ -1,6 +1,7 @@
 import pandas as pd
 import os
 from typing import List, Tuple
+from near_duplicates import mark_duplicates
 
 def list_docs(folder_path: str,
               blacklist = ['Source.txt', 'Source Link.txt', 'Source Links.txt']) -> Tuple[List[str], List[str]]:
@@ -27,15 +28,23 @@ def list_docs(folder_path: str,
 
     return doc_names, doc_paths
 
-def read_docs_to_df(folder_path: str) -> pd.DataFrame:
+def read_docs_to_df(folder_path: str,
+                    find_duplicates: bool = False,
+                    duplicate_threshold: float = 0.5) -> pd.DataFrame:
     """Takes in a folder (can also be with different subfolders) with policy-related text documents
     and gathers txt docs to analyze from those folders and makes a dataframe of their names and paths.
 
     NOTE: If want to preserve names and paths of the documents and make them easily searchable, it might be useful
     to export the dictionary/keep that as well to add more summary information about the document for instance.
 
+    With find_duplicates, near-identical documents (e.g. a text and the OCR text of the same PDF) are grouped
+    (see near_duplicates.mark_duplicates) and only the text version of each group is marked as canonical, so
+    the pipeline can process policy_doc_df[policy_doc_df['is_canonical']] only.
+
     Args:
         folder_path (str): The path to the parent folder.
+        find_duplicates (bool): add the 'canonical_doc' and 'is_canonical' columns
+        duplicate_threshold (float): smallest estimated Jaccard similarity of the word 3-shingles of near duplicates
 
     Returns:
         policy_doc_df (pd.DataFrame): A pd.DataFrame containing all found files as rows and the corresponding file names
@@ -55,4 +64,6 @@ def read_docs_to_df(folder_path: str) -> pd.DataFrame:
             lambda x: x.split('.txt')[0].split('.pdf.ocr')[0]))
     doc_df.index = doc_df['policy_doc_names']
     del doc_df['policy_doc_names']  #remove duplicate column
+    if find_duplicates:
+        doc_df = mark_duplicates(doc_df, threshold=duplicate_threshold)
     return doc_df
\ No newline at end of file
@@ -0,0 +1,133 @@
+"""On-disk cache of parsed spacy documents for GIZ-Policy"""
+
+import hashlib
+import json
+import os
+import tempfile
+import spacy
+from spacy.tokens import Doc, DocBin
+from typing import Dict, List, Optional
+
+CACHE_FILE_SUFFIX = '.spacy'
+
+
+def doc_cache_key(raw_text: bytes, nlp: object, options: Dict) -> str:
+    """Computes the cache key of a parsed document.
+
+    The key changes whenever the raw text, the spacy version, the loaded model
+    (name and version) or any of the preprocessing options change, so stale
+    entries are never returned and simply age out of the cache.
+
+    Args:
+        raw_text (bytes): raw content of the input document
+        nlp (object): spacy pipeline used for parsing
+        options (Dict): JSON serializable preprocessing options
+
+    Returns (str):
+        hexadecimal digest identifying the parsed document
+    """
+    digest = hashlib.sha256(raw_text)
+    model = {
+        'spacy': spacy.__version__,
+        'lang': nlp.meta.get('lang'),
+        'name': nlp.meta.get('name'),
+        'version': nlp.meta.get('version'),
+    }
+    digest.update(json.dumps([model, options], sort_keys=True).encode('utf8'))
+    return digest.hexdigest()
+
+
+class DocCache:
+    """A size-bounded, least recently used cache of parsed documents
+
+    Every entry is a spacy DocBin file named after its key (see doc_cache_key).
+    Reading an entry marks it as recently used, and whenever the total size of
+    the cache exceeds max_size_mb the least recently used entries are deleted.
+
+    Example:
+        cache = DocCache('../cache/docs', max_size_mb=256)
+        tokens, token_list, sentences = preprocess_doc(doc_path, cache=cache)
+
+    Args:
+        cache_dir (str): folder holding the cached documents
+        max_size_mb (float): upper bound on the total size of the cache
+    """
+
+    def __init__(self, cache_dir: str, max_size_mb: float = 512) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + CACHE_FILE_SUFFIX)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str, vocab: object) -> Optional[Doc]:
+        """Loads a cached document.
+
+        Args:
+            key (str): cache key of the document
+            vocab (object): vocabulary of the pipeline the document belongs to
+
+        Returns (Optional[Doc]):
+            the cached document, None if it is not in the cache
+        """
+        path = self._path(key)
+        try:
+            doc_bin = DocBin().from_disk(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        # the modification time records the last use for the eviction order
+        os.utime(path)
+        return list(doc_bin.get_docs(vocab))[0]
+
+    def put(self, key: str, doc: Doc) -> None:
+        """Stores a document and evicts old entries if the cache is full.
+
+        Args:
+            key (str): cache key of the document
+            doc (Doc): parsed document to store
+        """
+        doc_bin = DocBin(docs=[doc], store_user_data=True)
+        # write to a temporary file first, so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        doc_bin.to_disk(tmp_path)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def entries(self) -> List[os.DirEntry]:
+        """Lists the cache entries, least recently used first."""
+        entries = [
+            entry for entry in os.scandir(self.cache_dir)
+            if entry.name.endswith(CACHE_FILE_SUFFIX)
+        ]
+        return sorted(entries, key=lambda entry: entry.stat().st_mtime)
+
+    def size(self) -> int:
+        """Returns the total size of the cache in bytes."""
+        return sum(entry.stat().st_size for entry in self.entries())
+
+    def evict(self) -> int:
+        """Deletes least recently used entries until the cache fits its size bound.
+
+        Returns (int):
+            number of deleted entries
+        """
+        entries = self.entries()
+        total = sum(entry.stat().st_size for entry in entries)
+        n_evicted = 0
+        for entry in entries:
+            if total <= self.max_size:
+                break
+            total -= entry.stat().st_size
+            os.remove(entry.path)
+            n_evicted += 1
+        return n_evicted
+
+    def clear(self) -> None:
+        """Deletes all cache entries."""
+        for entry in self.entries():
+            os.remove(entry.path)
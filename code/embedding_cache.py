@@ -0,0 +1,213 @@
+"""Two-tier cache of sentence embeddings for GIZ-Policy"""
+
+import fcntl
+import hashlib
+import json
+import os
+import numpy as np
+import instrumentation
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+
+def embedding_key(model_id: str, text: str) -> int:
+    """Computes the 64 bit cache key of a text embedded by a given model.
+
+    Args:
+        model_id (str): identifier of the embedding model, e.g. its URL
+        text (str): embedded text
+
+    Returns (int):
+        cache key
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(model_id.encode('utf8'))
+    digest.update(b'\0')
+    digest.update(text.encode('utf8'))
+    return int.from_bytes(digest.digest(), 'little')
+
+
+class EmbeddingCache:
+    """A cache in front of a sentence embedding model
+
+    Embeddings are looked up in an in-process LRU tier first and, if a cache
+    folder is given, in a persistent tier backed by an np.memmap of all vectors
+    ever embedded with the model. Only the texts found in neither tier are sent
+    to the model, each distinct text once per call. The persistent tier is
+    append-only and shared between processes (appends are serialized with a
+    file lock), so repeated corpus runs and parallel workers reuse each other's
+    embeddings.
+
+    Example:
+        cache = EmbeddingCache(MODEL_URL, hub.load(MODEL_URL), cache_dir='../cache/embeddings')
+        embeddings = cache(["climate change", "adaption program"])
+        print(cache.stats())
+
+    Args:
+        model_id (str): identifier of the embedding model, part of every cache key
+        embed (Callable): the model, maps a list of strings to a 2d array of embeddings
+        cache_dir (Optional[str]): folder of the persistent tier, memory only if None
+        max_memory_items (int): number of embeddings kept in the LRU tier
+    """
+
+    def __init__(self,
+                 model_id: str,
+                 embed: Callable,
+                 cache_dir: Optional[str] = None,
+                 max_memory_items: int = 100000) -> None:
+        self.model_id = model_id
+        self.embed = embed
+        self.max_memory_items = max_memory_items
+        self.memory = OrderedDict()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        self.dim = None
+        self.disk_dir = None
+        self.disk_rows: Dict[int, int] = {}
+        self.disk_vectors = None
+        # number of keys of the persistent tier read so far
+        self._keys_read = 0
+        if cache_dir is not None:
+            model_hash = hashlib.sha1(model_id.encode('utf8')).hexdigest()[:16]
+            self.disk_dir = os.path.join(cache_dir, model_hash)
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._refresh_disk()
+
+    def _disk_path(self, name: str) -> str:
+        return os.path.join(self.disk_dir, name)
+
+    def _refresh_disk(self) -> None:
+        """Picks up rows appended to the persistent tier since the last refresh.
+
+        Only the keys written since the last refresh are read. A row is only
+        used if both its key and its vector are complete, so a partial write
+        of an interrupted append is ignored.
+        """
+        keys_path = self._disk_path('keys.u64')
+        if not os.path.exists(keys_path):
+            return
+        if self.dim is None:
+            with open(self._disk_path('meta.json')) as f:
+                self.dim = json.load(f)['dim']
+
+        with open(keys_path, 'rb') as f:
+            f.seek(self._keys_read * 8)
+            tail = f.read()
+        new_keys = np.frombuffer(tail[:len(tail) - len(tail) % 8], dtype=np.uint64)
+        vector_rows = os.path.getsize(self._disk_path('vectors.f32')) // (4 * self.dim)
+        # the vectors of an append are written before its keys, so every key has a vector
+        new_keys = new_keys[:max(vector_rows - self._keys_read, 0)]
+        for row, key in enumerate(new_keys.tolist(), self._keys_read):
+            self.disk_rows[key] = row
+        self._keys_read += len(new_keys)
+        if len(new_keys):
+            self.disk_vectors = np.memmap(self._disk_path('vectors.f32'),
+                                          dtype=np.float32,
+                                          mode='r',
+                                          shape=(self._keys_read, self.dim))
+
+    def _append_disk(self, keys: List[int], vectors: np.ndarray) -> None:
+        """Appends new embeddings to the persistent tier."""
+        with open(self._disk_path('lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            meta_path = self._disk_path('meta.json')
+            if not os.path.exists(meta_path):
+                with open(meta_path, 'w') as f:
+                    json.dump({'model_id': self.model_id, 'dim': vectors.shape[1]}, f)
+            keys_path = self._disk_path('keys.u64')
+            vectors_path = self._disk_path('vectors.f32')
+            # drop the partial rows of an append that was interrupted between the two
+            # writes, so the rows of both files stay aligned
+            n_rows = os.path.getsize(keys_path) // 8 if os.path.exists(keys_path) else 0
+            if os.path.exists(vectors_path):
+                n_rows = min(n_rows, os.path.getsize(vectors_path) // (4 * vectors.shape[1]))
+                os.truncate(vectors_path, n_rows * 4 * vectors.shape[1])
+            if os.path.exists(keys_path):
+                os.truncate(keys_path, n_rows * 8)
+            # vectors first, a row only becomes visible once its key is written
+            with open(vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            with open(keys_path, 'ab') as f:
+                f.write(np.asarray(keys, dtype=np.uint64).tobytes())
+        self._refresh_disk()
+
+    def _remember(self, key: int, vector: np.ndarray) -> None:
+        self.memory[key] = vector
+        if len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        """Embeds a list of texts, using cached embeddings where possible.
+
+        Args:
+            texts (List[str]): texts to embed
+
+        Returns (np.ndarray):
+            embeddings of the texts, one row per text
+        """
+        texts = [str(text) for text in texts]
+        unique_texts = list(dict.fromkeys(texts))
+        vectors = {}
+        missing = []
+        for text in unique_texts:
+            key = embedding_key(self.model_id, text)
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                vectors[text] = self.memory[key]
+                self.hits_memory += 1
+            elif key in self.disk_rows:
+                vectors[text] = np.array(self.disk_vectors[self.disk_rows[key]])
+                self._remember(key, vectors[text])
+                self.hits_disk += 1
+            else:
+                missing.append((key, text))
+
+        if missing and self.disk_dir is not None:
+            # another process may have embedded some of them in the meantime
+            self._refresh_disk()
+            still_missing = []
+            for key, text in missing:
+                if key in self.disk_rows:
+                    vectors[text] = np.array(self.disk_vectors[self.disk_rows[key]])
+                    self._remember(key, vectors[text])
+                    self.hits_disk += 1
+                else:
+                    still_missing.append((key, text))
+            missing = still_missing
+
+        instrumentation.count('embedding_cache_hits', len(unique_texts) - len(missing))
+        if missing:
+            self.misses += len(missing)
+            instrumentation.count('embedded_strings', len(missing))
+            with instrumentation.timer('embed'):
+                embedded = np.asarray(self.embed([text for _, text in missing]),
+                                      dtype=np.float32)
+            self.dim = embedded.shape[1]
+            for (key, text), vector in zip(missing, embedded):
+                # copy, so the LRU tier does not keep the whole batch alive
+                vectors[text] = vector.copy()
+                self._remember(key, vectors[text])
+            if self.disk_dir is not None:
+                self._append_disk([key for key, _ in missing], embedded)
+
+        if not texts:
+            if self.dim is None:
+                return np.asarray(self.embed([]), dtype=np.float32)
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([vectors[text] for text in texts])
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the hit and miss counters of the cache.
+
+        Returns (Dict[str, float]):
+            hits per tier, misses, and the share of lookups served from the cache
+        """
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            'hits_memory': self.hits_memory,
+            'hits_disk': self.hits_disk,
+            'misses': self.misses,
+            'hit_rate': (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,158 @@
+"""Sentence encoders for GIZ-Policy
+
+All encoders map a list of strings to a 2d array of embeddings, one row per
+string, and carry a model_id that identifies them in the embedding cache.
+Besides the Universal Sentence Encoder from TF-Hub there are two backends
+that work fully offline and on CPU only: hashed character n-gram vectors,
+which need no model at all, and averaged spacy static word vectors.
+
+    Typical usage example:
+
+    encoder = get_sentence_encoder("hashed-ngram")
+    correlator = KeywordCorrelator(climate_keywords, encoder=encoder)
+"""
+
+import abc
+import numpy as np
+from typing import Dict, List, Tuple, Union
+from model_registry import get_encoder, get_spacy_model
+
+# Could put this URL in a configuration file, or load from environment variables
+MODEL_URL = "https://tfhub.dev/google/universal-sentence-encoder/4"
+
+# odd 64 bit constants for the rolling and the finalizing hash
+_HASH_BASE = np.uint64(0x100000001B3)
+_HASH_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+class SentenceEncoder(abc.ABC):
+    """Interface of a sentence encoder
+
+    Parameters:
+        model_id (str): identifies the encoder and its settings in the embedding cache
+    """
+
+    model_id = ""
+
+    @abc.abstractmethod
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        """Embeds a list of texts.
+
+        Args:
+            texts (List[str]): texts to embed
+
+        Returns (np.ndarray):
+            embeddings of the texts, one row per text
+        """
+
+
+class TFHubEncoder(SentenceEncoder):
+    """Sentence encoder backed by a TF-Hub model, loaded through the model registry on first use
+
+    Args:
+        model_url (str): url of the tensorflow model that embeds sentences
+    """
+
+    def __init__(self, model_url: str = MODEL_URL) -> None:
+        self.model_id = model_url
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(get_encoder(self.model_id)(texts), dtype=np.float32)
+
+
+class HashedNGramEncoder(SentenceEncoder):
+    """Offline sentence encoder based on hashed character n-grams
+
+    Every lowercase character n-gram of a text (including the text boundaries)
+    is hashed into one of dim buckets with a random sign, and the bucket counts
+    are L2-normalized. Texts sharing many n-grams, like different inflections
+    of the same words, get a high inner product. There is no model to load,
+    and all texts of a call are hashed at once with NumPy.
+
+    Args:
+        dim (int): number of hash buckets, i.e. the embedding size
+        ngram_range (Tuple[int, int]): smallest and largest n-gram size
+    """
+
+    def __init__(self, dim: int = 512, ngram_range: Tuple[int, int] = (3, 5)) -> None:
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.model_id = f"hashed-ngram:{dim}:{ngram_range[0]}-{ngram_range[1]}"
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        encoded = [b' ' + str(text).lower().encode('utf8') + b' ' for text in texts]
+        lengths = np.array([len(text) for text in encoded], dtype=np.int64)
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+        text_ids = np.repeat(np.arange(len(encoded)), lengths)
+        text_ends = np.cumsum(lengths)[text_ids]
+
+        bins = []
+        signs = []
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            starts = np.flatnonzero(np.arange(len(data)) + n <= text_ends)
+            hashes = np.full(len(starts), n, dtype=np.uint64)
+            for k in range(n):
+                hashes = hashes * _HASH_BASE + data[starts + k]
+            hashes = (hashes ^ (hashes >> np.uint64(29))) * _HASH_MIX
+            hashes ^= hashes >> np.uint64(32)
+            bins.append(text_ids[starts] * self.dim + (hashes >> np.uint64(1)) % np.uint64(self.dim))
+            signs.append(1.0 - 2.0 * (hashes & np.uint64(1)).astype(np.float64))
+
+        counts = np.bincount(np.concatenate(bins).astype(np.int64),
+                             weights=np.concatenate(signs),
+                             minlength=len(encoded) * self.dim)
+        vectors = counts.reshape(len(encoded), self.dim).astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+
+class SpacyVectorEncoder(SentenceEncoder):
+    """Offline sentence encoder averaging the static word vectors of a spacy model
+
+    Only the tokenizer runs, the vectors are looked up per token. This needs a
+    model with word vectors, e.g. en_core_web_md or en_core_web_lg.
+
+    Args:
+        model (str): name of the spacy model package
+    """
+
+    def __init__(self, model: str = 'en_core_web_md') -> None:
+        self.model = model
+        self.model_id = f"spacy:{model}"
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        nlp = get_spacy_model(self.model)
+        vectors = np.array([doc.vector for doc in nlp.tokenizer.pipe(texts)],
+                           dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+
+_ENCODERS: Dict[str, SentenceEncoder] = {}
+
+
+def get_sentence_encoder(spec: Union[str, SentenceEncoder] = MODEL_URL) -> SentenceEncoder:
+    """Returns the shared encoder for a specification.
+
+    Specifications are "hashed-ngram", "spacy:<model name>" or the url of a
+    TF-Hub model; encoder instances are passed through unchanged.
+
+    Args:
+        spec (Union[str, SentenceEncoder]): encoder specification
+
+    Returns (SentenceEncoder):
+        the encoder
+    """
+    if isinstance(spec, SentenceEncoder):
+        return spec
+    if spec not in _ENCODERS:
+        if spec == "hashed-ngram":
+            _ENCODERS[spec] = HashedNGramEncoder()
+        elif spec.startswith("spacy:"):
+            _ENCODERS[spec] = SpacyVectorEncoder(spec[len("spacy:"):])
+        elif spec.startswith("http") or spec.startswith("/"):
+            _ENCODERS[spec] = TFHubEncoder(spec)
+        else:
+            raise ValueError(f"Unknown sentence encoder '{spec}', use 'hashed-ngram', "
+                             "'spacy:<model name>' or the url of a TF-Hub model")
+    return _ENCODERS[spec]
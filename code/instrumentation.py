@@ -0,0 +1,271 @@
+"""Lightweight instrumentation of the GIZ-Policy pipeline
+
+Timers and counters are collected in one process-wide Stats object while
+instrumentation is enabled (instrumentation.enable() or the environment
+variable GIZ_INSTRUMENTATION=1). While it is disabled, timer() returns a
+shared no-op context manager and count() returns right away, so the calls
+can stay in the pipeline code.
+
+Timers in use: read_file, fix_contractions, parse, filter_tokens, embed,
+score_n_grams, resolve_entities and, with instrument_pipeline, one
+'component:<name>' timer per spacy component. Counters in use: docs, tokens,
+parsed_tokens, doc_cache_hits, embedded_strings, embedding_cache_hits, n_grams,
+n_grams_pruned_<stage> (see n_gram_correlation.PRUNING_STAGES),
+entities_added and overlap_rejections.
+
+    Typical usage example:
+
+    instrumentation.enable()
+    instrumentation.instrument_pipeline(nlppreprocess.get_nlp())
+    instrumentation.profile_document(doc_path, 'parse.prof')
+    parsed_docs = preprocess_corpus(policy_doc_df)
+    print(instrumentation.get_stats().to_dict())
+    instrumentation.get_stats().dump_json('stats.json')
+"""
+
+import cProfile
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+from spacy.language import Language
+from spacy.tokens import Doc
+
+_enabled = os.environ.get('GIZ_INSTRUMENTATION') == '1'
+
+
+class Stats:
+    """Timers and counters collected while instrumentation is enabled
+
+    Parameters:
+        timers (Dict[str, Dict[str, float]]): calls, total_s and max_s per timer
+        counters (Dict[str, int]): value per counter
+    """
+
+    def __init__(self) -> None:
+        self.timers: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {}
+
+    def add_time(self, name: str, seconds: float) -> None:
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = {'calls': 0, 'total_s': 0.0, 'max_s': 0.0}
+        timer['calls'] += 1
+        timer['total_s'] += seconds
+        timer['max_s'] = max(timer['max_s'], seconds)
+
+    def add_count(self, name: str, n: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self) -> None:
+        """Forgets all timers and counters."""
+        self.timers.clear()
+        self.counters.clear()
+
+    def to_dict(self) -> Dict[str, Dict]:
+        """Returns the stats as plain dictionaries, timers sorted by total time.
+
+        Returns (Dict[str, Dict]):
+            'timers' and 'counters'
+        """
+        timers = sorted(self.timers.items(), key=lambda item: item[1]['total_s'], reverse=True)
+        return {'timers': {name: dict(timer) for name, timer in timers},
+                'counters': dict(self.counters)}
+
+    def dump_json(self, path: str) -> None:
+        """Writes the stats to a json file.
+
+        Args:
+            path (str): file to write
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+
+_stats = Stats()
+
+
+def enable() -> None:
+    """Starts collecting stats."""
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    """Stops collecting stats, the stats collected so far are kept."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def get_stats() -> Stats:
+    """Returns the process-wide stats."""
+    return _stats
+
+
+class _Timer:
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> '_Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        _stats.add_time(self.name, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullTimer':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name: str):
+    """Times the block of a with statement.
+
+    Example:
+        with instrumentation.timer('parse'):
+            tokens = nlp(text)
+
+    Args:
+        name (str): name of the timer
+    """
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+
+def count(name: str, n: int = 1) -> None:
+    """Increases a counter.
+
+    Args:
+        name (str): name of the counter
+        n (int): amount to add
+    """
+    if _enabled:
+        _stats.add_count(name, n)
+
+
+# time at which every document in the pipeline passed its last timer component
+_doc_clock: Dict[int, float] = {}
+
+TIMER_COMPONENT_PREFIX = 'giz_timer_'
+
+
+@Language.factory('giz_component_timer', default_config={'timed_component': None})
+class ComponentTimer:
+    """Pipeline component measuring the time spent in the component before it
+
+    instrument_pipeline puts one in front of the first component and one
+    after every component. Each one charges the time since the document
+    passed the previous one to the component in between. Documents parsed
+    one by one (nlp(text)) are timed exactly; with nlp.pipe, components that
+    work on batches make the times of a batch spread over its documents, the
+    totals per component stay meaningful.
+
+    Args:
+        timed_component (Optional[str]): name of the component before this one,
+            None for the component in front of the pipeline
+    """
+
+    def __init__(self, nlp: Language, name: str, timed_component: Optional[str]) -> None:
+        self.nlp = nlp
+        self.timed_component = timed_component
+        self.last = False
+
+    def __call__(self, doc: Doc) -> Doc:
+        now = time.perf_counter()
+        if (_enabled and self.timed_component is not None and
+                self.timed_component not in self.nlp.disabled):
+            started = _doc_clock.get(id(doc))
+            if started is not None:
+                _stats.add_time('component:' + self.timed_component, now - started)
+        if self.last:
+            _doc_clock.pop(id(doc), None)
+        else:
+            _doc_clock[id(doc)] = now
+        return doc
+
+
+def instrument_pipeline(nlp: Language) -> List[str]:
+    """Adds ComponentTimer components around every component of a pipeline.
+
+    Disabled components are timed once they are enabled. Call it again after
+    adding components to a pipeline.
+
+    Args:
+        nlp (Language): the spacy pipeline
+
+    Returns (List[str]):
+        names of the added timer components
+    """
+    remove_pipeline_instrumentation(nlp)
+    components = list(nlp.component_names)
+    added = [TIMER_COMPONENT_PREFIX + 'start']
+    nlp.add_pipe('giz_component_timer', name=added[0], first=True)
+    for name in components:
+        added.append(TIMER_COMPONENT_PREFIX + name)
+        nlp.add_pipe('giz_component_timer', name=added[-1], after=name,
+                     config={'timed_component': name})
+    nlp.get_pipe(added[-1]).last = True
+    return added
+
+
+def remove_pipeline_instrumentation(nlp: Language) -> None:
+    """Removes the components added by instrument_pipeline."""
+    for name in list(nlp.component_names):
+        if name.startswith(TIMER_COMPONENT_PREFIX):
+            nlp.remove_pipe(name)
+
+
+_profile_target: Optional[str] = None
+_profile_output: Optional[str] = None
+
+
+def profile_document(doc_path: Optional[str], output_path: str = 'giz_profile.prof') -> None:
+    """Chooses a document whose preprocessing is captured with cProfile.
+
+    The profile can be inspected with pstats or snakeviz. Profiling works
+    independently of enable().
+
+    Args:
+        doc_path (Optional[str]): path of the document, None to stop profiling
+        output_path (str): file the profile stats are written to
+    """
+    global _profile_target, _profile_output
+    _profile_target = None if doc_path is None else os.path.abspath(doc_path)
+    _profile_output = output_path
+
+
+def is_profiled(doc_path: str) -> bool:
+    """Checks whether a document was chosen with profile_document."""
+    return _profile_target is not None and os.path.abspath(doc_path) == _profile_target
+
+
+@contextmanager
+def profiling(doc_path: str) -> Iterator[None]:
+    """Captures a cProfile of the block if the document was chosen with profile_document."""
+    if not is_profiled(doc_path):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(_profile_output)
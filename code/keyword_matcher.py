@@ -0,0 +1,222 @@
+"""Multi-keyword matcher for GIZ-Policy
+
+Finds all keywords of the SDG ontology and the NDC keyword files in a text
+with a single pass of an Aho-Corasick automaton over its words, instead of
+one regular expression scan (find_patterns_df) or one PhraseMatcher
+(label_ndc_spans) per keyword. The automaton is built once and can be saved
+and loaded again.
+
+    Typical usage example:
+
+    matcher = KeywordMatcher.from_files(ONTOLOGY_PATH, ['../ndc_keywords/ndc_ethiopia.json'])
+    matcher.save('../cache/keyword_matcher.pkl')
+
+    matcher = KeywordMatcher.load('../cache/keyword_matcher.pkl')
+    for topic, keyword, start, end in matcher.find(text):
+        ...
+"""
+
+import codecs
+import json
+import os
+import pickle
+import re
+import pandas as pd
+from typing import Dict, Iterable, List, Tuple
+
+ONTOLOGY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                             'additional_resources', 'Ontology_final_modified.csv')
+
+# keywords and texts are compared word by word, punctuation characters are words of their own
+_WORD = re.compile(r'\w+|[^\w\s]')
+
+
+def load_ontology(path: str = ONTOLOGY_PATH, topic_column: str = 'clasification') -> Dict[str, List[str]]:
+    """Reads the keywords of every topic of an ontology csv file.
+
+    Args:
+        path (str): path of the ';' separated ontology file
+        topic_column (str): column containing the topic of a keyword
+
+    Returns (Dict[str, List[str]]):
+        a mapping of all topics to their keywords
+    """
+    ontology = pd.read_csv(path, sep=';')
+    topic_to_keywords = {}
+    for keyword, topic in zip(ontology['keyword'].astype(str), ontology[topic_column]):
+        topic_to_keywords.setdefault(topic, []).append(keyword.strip())
+    return topic_to_keywords
+
+
+def load_ndc_keywords(path: str, label_suffix: str = ' NDC') -> Dict[str, List[str]]:
+    """Reads an NDC keyword file.
+
+    Args:
+        path (str): path of a json file mapping NDC topics to keywords
+        label_suffix (str): appended to every topic, as in the NDC entity labels of the notebooks
+
+    Returns (Dict[str, List[str]]):
+        a mapping of all labelled topics to their keywords
+    """
+    with codecs.open(path, encoding="utf8") as f:
+        ndc_keywords = json.load(f)
+    return {topic + label_suffix: keywords for topic, keywords in ndc_keywords.items()}
+
+
+class KeywordMatcher:
+    """Finds the keywords of many topics in a text in a single pass
+
+    The keywords are split into words and compiled into an Aho-Corasick
+    automaton whose alphabet is the vocabulary of the keywords. Matching a
+    text walks through its words once, following a failure link whenever a
+    word does not continue the current keyword prefix, and reports every
+    keyword ending at a word, overlapping hits of different keywords
+    included. Keywords only match whole words, so "oil" is not found in
+    "soil". A keyword listed under several topics is reported once per topic.
+
+    Example:
+        matcher = KeywordMatcher(load_ontology())
+        matches = matcher.find("Access to clean water and sanitation")
+
+    Args:
+        topic_to_keywords (Dict[str, List[str]]): a mapping of all topics to their keywords
+        lowercase (bool): match case-insensitively (the ontology keywords are lowercase)
+    """
+
+    def __init__(self, topic_to_keywords: Dict[str, List[str]], lowercase: bool = True) -> None:
+        self.lowercase = lowercase
+        self.word_ids: Dict[str, int] = {}
+        # keyword patterns as (topic, keyword, number of words)
+        self.patterns: List[Tuple[str, str, int]] = []
+        # automaton: transitions, failure link and matched patterns of every state
+        self.goto: List[Dict[int, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[List[int]] = [[]]
+
+        for topic, keywords in topic_to_keywords.items():
+            for keyword in keywords:
+                self._add_keyword(topic, keyword)
+        self._build_failure_links()
+
+    def _words(self, text: str) -> Iterable[Tuple[str, int, int]]:
+        """Splits a text into its words with their character offsets."""
+        for match in _WORD.finditer(text):
+            word = match.group()
+            yield (word.lower() if self.lowercase else word), match.start(), match.end()
+
+    def _add_keyword(self, topic: str, keyword: str) -> None:
+        words = [word for word, _, _ in self._words(keyword)]
+        if not words:
+            return
+        state = 0
+        for word in words:
+            word_id = self.word_ids.setdefault(word, len(self.word_ids))
+            if word_id not in self.goto[state]:
+                self.goto[state][word_id] = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+            state = self.goto[state][word_id]
+        if any(self.patterns[pattern][0] == topic for pattern in self.outputs[state]):
+            # listed twice under the same topic
+            return
+        self.outputs[state].append(len(self.patterns))
+        self.patterns.append((topic, keyword, len(words)))
+
+    def _build_failure_links(self) -> None:
+        """Links every state to the state of its longest proper suffix, breadth first."""
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for word_id, next_state in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and word_id not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(word_id, 0)
+                # keywords ending in the suffix also end here
+                self.outputs[next_state].extend(self.outputs[self.fail[next_state]])
+                queue.append(next_state)
+
+    def find(self, text: str) -> List[Tuple[str, str, int, int]]:
+        """Finds all keyword hits in a text.
+
+        Args:
+            text (str): text to search
+
+        Returns (List[Tuple[str, str, int, int]]):
+            topic, keyword, start and end character of every hit, in the order
+            in which the hits end in the text
+        """
+        goto, fail, outputs, patterns = self.goto, self.fail, self.outputs, self.patterns
+        word_ids = self.word_ids
+        word_starts = []
+        matches = []
+        state = 0
+        for word, start, end in self._words(text):
+            word_starts.append(start)
+            word_id = word_ids.get(word)
+            if word_id is None:
+                # a word that is in no keyword resets the automaton
+                state = 0
+                continue
+            while state and word_id not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word_id, 0)
+            for pattern in outputs[state]:
+                topic, keyword, n_words = patterns[pattern]
+                matches.append((topic, keyword, word_starts[-n_words], end))
+        return matches
+
+    def find_df(self, text: str) -> pd.DataFrame:
+        """Finds all keyword hits in a text, see find.
+
+        Args:
+            text (str): text to search
+
+        Returns (pd.DataFrame):
+            one row per hit with the columns topic, keyword, start and end
+        """
+        return pd.DataFrame(self.find(text), columns=['topic', 'keyword', 'start', 'end'])
+
+    @classmethod
+    def from_files(cls, ontology_path: str = ONTOLOGY_PATH, ndc_paths: Iterable[str] = (),
+                   lowercase: bool = True) -> 'KeywordMatcher':
+        """Builds a matcher from the ontology and NDC keyword files.
+
+        Args:
+            ontology_path (str): path of the ontology csv file, None to leave it out
+            ndc_paths (Iterable[str]): paths of NDC keyword json files
+            lowercase (bool): match case-insensitively
+
+        Returns (KeywordMatcher):
+            matcher of the keywords of all files
+        """
+        topic_to_keywords = {} if ontology_path is None else load_ontology(ontology_path)
+        for path in ndc_paths:
+            for topic, keywords in load_ndc_keywords(path).items():
+                topic_to_keywords.setdefault(topic, []).extend(keywords)
+        return cls(topic_to_keywords, lowercase=lowercase)
+
+    def save(self, path: str) -> None:
+        """Saves the compiled matcher.
+
+        Args:
+            path (str): file to write
+        """
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> 'KeywordMatcher':
+        """Loads a matcher saved with save.
+
+        Args:
+            path (str): file to read
+
+        Returns (KeywordMatcher):
+            the compiled matcher
+        """
+        with open(path, 'rb') as f:
+            matcher = pickle.load(f)
+        if not isinstance(matcher, cls):
+            raise TypeError(f"{path} does not contain a {cls.__name__}")
+        return matcher
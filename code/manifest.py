@@ -0,0 +1,214 @@
+"""File manifest for incremental corpus processing
+
+The manifest records, for every document of a corpus folder, its size,
+modification time and content hash, and the version of the pipeline that
+produced its outputs. Comparing it with the folder tells which documents were
+added, changed or deleted since the last run, so only those are processed
+again. A file is only hashed when its size or modification time differs from
+the manifest.
+
+    Typical usage example:
+
+    def keyword_hits(doc_path):
+        with codecs.open(doc_path, errors="ignore", encoding="utf8") as f:
+            return matcher.find_df(f.read())
+
+    results = run_incremental('../test_resources/data', '../results/keyword_hits.pkl',
+                              keyword_hits, pipeline_version='keyword-hits-1')
+"""
+
+import hashlib
+import json
+import os
+import time
+import pandas as pd
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+MANIFEST_VERSION = 1
+
+DEFAULT_BLACKLIST = ['Source.txt', 'Source Link.txt', 'Source Links.txt']
+
+
+def scan_docs(folder_path: str, blacklist: List[str] = DEFAULT_BLACKLIST) -> Iterator[Tuple[str, os.stat_result]]:
+    """Lists the .txt documents of a folder and its subfolders, as datahelper.list_docs.
+
+    The file attributes come with the directory listing (os.scandir), so no
+    file is opened.
+
+    Args:
+        folder_path (str): The path to the parent folder.
+        blacklist (List[str]): A list of files which should not be included.
+
+    Returns (Iterator[Tuple[str, os.stat_result]]):
+        path and file attributes of every document
+    """
+    with os.scandir(folder_path) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if entry.is_dir():
+                yield from scan_docs(entry.path, blacklist)
+            elif entry.name.endswith('.txt') and entry.name not in blacklist:
+                yield entry.path, entry.stat()
+
+
+def file_hash(path: str) -> str:
+    """Computes the sha256 hash of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileManifest:
+    """The documents of a corpus folder as of the last processing run
+
+    Example:
+        manifest = FileManifest('../results/manifest.json')
+        changes = manifest.scan('../test_resources/data', pipeline_version='1')
+        for doc_path in changes['added'] + changes['changed']:
+            ...  # process the document
+            manifest.record(doc_path)
+        for doc_path in changes['deleted']:
+            manifest.remove(doc_path)
+        manifest.save()
+
+    Args:
+        manifest_path (str): json file of the manifest, created on save if missing
+
+    Parameters:
+        entries (Dict[str, Dict]): size, mtime_ns, sha256 and pipeline_version per document path
+    """
+
+    def __init__(self, manifest_path: str) -> None:
+        self.manifest_path = manifest_path
+        self.entries: Dict[str, Dict] = {}
+        # hashes and file attributes of the last scan, recorded once a document is processed
+        self._scanned: Dict[str, Dict] = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.entries = manifest['documents']
+
+    def scan(self, folder_path: str, pipeline_version: str,
+             blacklist: List[str] = DEFAULT_BLACKLIST) -> Dict[str, List[str]]:
+        """Compares the documents of a folder with the manifest.
+
+        Args:
+            folder_path (str): The path to the parent folder.
+            pipeline_version (str): version of the processing the outputs should come from
+            blacklist (List[str]): A list of files which should not be included.
+
+        Returns (Dict[str, List[str]]):
+            the paths of the 'added', 'changed', 'deleted' and 'unchanged'
+            documents; a document processed by another pipeline version counts
+            as changed
+        """
+        changes = {'added': [], 'changed': [], 'deleted': [], 'unchanged': []}
+        self._scanned = {}
+        found = set()
+        for doc_path, stat in scan_docs(folder_path, blacklist):
+            found.add(doc_path)
+            entry = self.entries.get(doc_path)
+            scanned = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                       'pipeline_version': pipeline_version}
+            if entry is not None and all(entry[k] == scanned[k] for k in scanned):
+                changes['unchanged'].append(doc_path)
+                continue
+
+            scanned['sha256'] = file_hash(doc_path)
+            self._scanned[doc_path] = scanned
+            if entry is None:
+                changes['added'].append(doc_path)
+            elif (entry['sha256'] == scanned['sha256'] and
+                  entry['pipeline_version'] == pipeline_version):
+                # touched but not modified, only the attributes are updated
+                self.entries[doc_path] = scanned
+                changes['unchanged'].append(doc_path)
+            else:
+                changes['changed'].append(doc_path)
+
+        root = os.path.join(folder_path, '')
+        changes['deleted'] = sorted(doc_path for doc_path in self.entries
+                                    if doc_path.startswith(root) and doc_path not in found)
+        return changes
+
+    def record(self, doc_path: str) -> None:
+        """Marks a document found by the last scan as processed."""
+        self.entries[doc_path] = self._scanned.pop(doc_path)
+
+    def remove(self, doc_path: str) -> None:
+        """Removes a deleted document from the manifest."""
+        self.entries.pop(doc_path, None)
+
+    def save(self) -> None:
+        """Writes the manifest."""
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'documents': self.entries}, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+
+def run_incremental(folder_path: str,
+                    output_path: str,
+                    process_doc: Callable[[str], pd.DataFrame],
+                    pipeline_version: str,
+                    manifest_path: Optional[str] = None,
+                    blacklist: List[str] = DEFAULT_BLACKLIST) -> pd.DataFrame:
+    """Processes the new and changed documents of a corpus and merges their results.
+
+    The results of all documents are kept in one table (a pickled pd.DataFrame)
+    with a 'policy_doc_paths' column. The rows of changed and deleted documents
+    are replaced or dropped, the rows of unchanged documents are kept as they
+    are. The results are written before the manifest, so an interrupted run
+    processes the documents it did not record again.
+
+    Args:
+        folder_path (str): The path to the parent folder.
+        output_path (str): pickle file of the results table
+        process_doc (Callable[[str], pd.DataFrame]): computes the result rows of a document
+        pipeline_version (str): version of process_doc, change it to process all documents again
+        manifest_path (Optional[str]): json file of the manifest, next to output_path if None
+        blacklist (List[str]): A list of files which should not be included.
+
+    Returns (pd.DataFrame):
+        the results of all documents
+    """
+    if manifest_path is None:
+        manifest_path = os.path.splitext(output_path)[0] + '.manifest.json'
+    manifest = FileManifest(manifest_path)
+    changes = manifest.scan(folder_path, pipeline_version, blacklist)
+
+    # results without a manifest are not known to be complete and are rebuilt
+    results = pd.DataFrame()
+    if manifest.entries and os.path.exists(output_path):
+        results = pd.read_pickle(output_path)
+    # added documents may have rows from a run interrupted before the manifest was saved
+    stale = set(changes['added'] + changes['changed'] + changes['deleted'])
+    if len(results) and stale:
+        results = results[~results['policy_doc_paths'].isin(stale)]
+
+    start = time.perf_counter()
+    to_process = changes['added'] + changes['changed']
+    new_results = []
+    for doc_path in to_process:
+        doc_results = process_doc(doc_path)
+        doc_results.insert(0, 'policy_doc_paths', doc_path)
+        new_results.append(doc_results)
+    elapsed = time.perf_counter() - start
+
+    results = pd.concat([results] + new_results, ignore_index=True)
+    tmp_path = output_path + '.tmp'
+    results.to_pickle(tmp_path)
+    os.replace(tmp_path, output_path)
+
+    for doc_path in to_process:
+        manifest.record(doc_path)
+    for doc_path in changes['deleted']:
+        manifest.remove(doc_path)
+    manifest.save()
+
+    print(f"Corpus run: {len(changes['added'])} added, {len(changes['changed'])} changed, "
+          f"{len(changes['deleted'])} deleted, {len(changes['unchanged'])} unchanged (skipped); "
+          f"recomputed {len(to_process)} documents in {elapsed:.1f}s")
+    return results
@@ -0,0 +1,91 @@
+"""Process-wide registry of the NLP models used by GIZ-Policy
+
+Models are loaded on first use, once per process, and shared by everything
+that asks for them (nlppreprocess, the correlators and the spacy factories).
+Importing a module therefore costs nothing until a model is actually needed.
+Worker pools can call preload() in the parent process, so the loaded (and
+warmed up) models are shared with the workers after the fork.
+
+    Typical usage example:
+
+    nlp = get_spacy_model('en_core_web_sm')
+    embed = get_encoder(MODEL_URL)
+    preload(spacy_models=['en_core_web_sm'], encoders=[MODEL_URL])
+"""
+
+import threading
+from typing import Callable, Dict, Iterable, List
+
+DEFAULT_SPACY_MODEL = 'en_core_web_sm'
+
+_models: Dict[str, object] = {}
+_lock = threading.RLock()
+
+
+def _get_or_load(key: str, load: Callable[[], object]) -> object:
+    # double-checked, so concurrent first uses do not load a model twice
+    if key not in _models:
+        with _lock:
+            if key not in _models:
+                _models[key] = load()
+    return _models[key]
+
+
+def get_spacy_model(name: str = DEFAULT_SPACY_MODEL) -> object:
+    """Returns the shared spacy pipeline of a model, loading it on first use.
+
+    Args:
+        name (str): name of the spacy model package
+
+    Returns (object):
+        the loaded spacy pipeline
+    """
+
+    def load():
+        import spacy
+        return spacy.load(name)
+
+    return _get_or_load('spacy:' + name, load)
+
+
+def get_encoder(model_url: str) -> Callable:
+    """Returns the shared sentence encoder of a tensorflow hub model, loading it on first use.
+
+    Args:
+        model_url (str): url of the tensorflow model that embeds sentences
+
+    Returns (Callable):
+        the loaded model, maps a list of strings to their embeddings
+    """
+
+    def load():
+        import tensorflow_hub as hub
+        return hub.load(model_url)
+
+    return _get_or_load('encoder:' + model_url, load)
+
+
+def loaded_models() -> List[str]:
+    """Lists the keys of the models loaded in this process so far."""
+    return list(_models)
+
+
+def preload(spacy_models: Iterable[str] = (DEFAULT_SPACY_MODEL,),
+            encoders: Iterable[str] = (),
+            warm_up: bool = True) -> None:
+    """Loads models ahead of time, e.g. before worker processes are forked.
+
+    Args:
+        spacy_models (Iterable[str]): names of the spacy models to load
+        encoders (Iterable[str]): urls of the sentence encoders to load
+        warm_up (bool): run every model once, so lazy initialization (graph
+            tracing, memory allocation) also happens before the fork
+    """
+    for name in spacy_models:
+        nlp = get_spacy_model(name)
+        if warm_up:
+            nlp('Warming up the pipeline.')
+    for model_url in encoders:
+        embed = get_encoder(model_url)
+        if warm_up:
+            embed(['Warming up the encoder.'])
@@ -1,19 +1,245 @@
 import spacy
+import numpy as np
+from spacy.attrs import ORTH, SENT_START
 from spacy.tokens import Span, Doc
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 # Can attach a special getter to a general span that will calculate the correlation to a group of keywords
 # Later on can make span groups based on the value of the correlation values.
-from correlation import SpanCorrelator
+import instrumentation
+from correlation import KeywordCorrelator, SpanCorrelator
+from encoders import MODEL_URL, get_sentence_encoder
+from nlppreprocess import token_allowed_array
+
+# stages of the candidate cascade, in order, as reported in NGramCorrelateSpacy.stats
+PRUNING_STAGES = ['sentence_boundary', 'no_allowed_token', 'prescore']
+
+# approximate bytes of the text of an n-gram and its entries in the batch lists and dict
+_TEXT_BYTES = 200
 
 
 class NGramCorrelateSpacy:
+    """Tags the n-grams of a document that correlate with a list of keywords
+
+    The n-grams are scored as a stream: the candidates (start and end index
+    arrays) are cut into batches that fit a memory budget, and every distinct
+    n-gram text of a batch is embedded once. The n-grams go straight to the
+    encoder, not through the shared embedding cache (only the keywords are
+    cached), so nothing is kept from one batch to the next and peak memory of
+    the scoring depends on the budget, not on the length of the document.
+
+    Before the encoder, the candidates of all requested n-gram sizes go
+    through a cascade of cheap filters computed on token attribute arrays:
+        - sentence_boundary: n-grams crossing a sentence boundary are dropped
+          (if the document has sentence boundaries)
+        - no_allowed_token: n-grams made only of stop words, punctuation and
+          whitespace (see nlppreprocess.is_token_allowed) are dropped
+        - prescore: with prescore_threshold set, n-grams whose best allowed
+          token scores below it are dropped. Every distinct word form of the
+          document is embedded once with prescore_encoder (e.g. "hashed-ngram"
+          for an offline pre-score), in batches of the same memory budget.
+    The number of n-grams removed by every stage of the last call is kept in
+    self.stats; pruning_recall measures how many of the n-grams found by the
+    exhaustive path are still found.
+
+    Example:
+        n_gram_cor = NGramCorrelateSpacy(climate_keywords, 0.7, "CLIMATE_N")
+        n_gram_cor.correlate_spans(doc, 4)
+        n_gram_cor.correlate_spans(doc, [2, 3, 4])
+        print(n_gram_cor.stats)
+
+    Args:
+        keywords (List[str]): list of subject keywords
+        threshold (float): correlation threshold for an n-gram to be labeled
+        tag (str): label for the n-grams, will appear in displacy plot
+        memory_budget_mb (float): approximate memory used per batch of n-grams or word forms
+        encoder (Union[str, SentenceEncoder]): sentence encoder, the Universal Sentence Encoder if None
+        sentence_bounded (bool): drop n-grams crossing a sentence boundary
+        prune_disallowed (bool): drop n-grams without an allowed token
+        prescore_threshold (Optional[float]): smallest token pre-score of an
+            n-gram sent to the encoder, no pre-scoring if None
+        prescore_encoder (Union[str, SentenceEncoder]): encoder of the token
+            pre-scores, the encoder of the n-grams if None
+    """
+
+    def __init__(self, keywords, threshold, tag, memory_budget_mb=64, encoder=None,
+                 sentence_bounded: bool = True, prune_disallowed: bool = True,
+                 prescore_threshold: Optional[float] = None, prescore_encoder=None) -> None:
+        self.correlator = SpanCorrelator(keywords, threshold, tag, encoder=encoder)
+        self.encoder = get_sentence_encoder(MODEL_URL if encoder is None else encoder)
+        self.keyword_embeddings = self.correlator.correlator.keyword_embeddings
+        self.batch_size = self._batch_size(self.keyword_embeddings, memory_budget_mb)
+
+        self.sentence_bounded = sentence_bounded
+        self.prune_disallowed = prune_disallowed
+        self.prescore_threshold = prescore_threshold
+        self.prescore_encoder = None
+        if prescore_threshold is not None:
+            self.prescore_encoder = get_sentence_encoder(
+                prescore_encoder if prescore_encoder is not None else self.encoder)
+            self.prescore_keyword_embeddings = KeywordCorrelator(
+                list(keywords), encoder=self.prescore_encoder).keyword_embeddings
+            self.prescore_batch_size = self._batch_size(self.prescore_keyword_embeddings,
+                                                        memory_budget_mb)
+        self.stats: Dict[str, int] = {}
+
+    @staticmethod
+    def _batch_size(keyword_embeddings: np.ndarray, memory_budget_mb: float) -> int:
+        n_keywords, embedding_dim = np.shape(keyword_embeddings)
+        # an embedding row, a column of the keyword correlation matrix and the text per n-gram
+        bytes_per_text = 4 * (embedding_dim + n_keywords) + _TEXT_BYTES
+        return max(1, int(memory_budget_mb * 1024 * 1024 / bytes_per_text))
+
+    @staticmethod
+    def _score_texts(encoder, keyword_embeddings: np.ndarray, texts: List[str]) -> np.ndarray:
+        """Embeds every distinct text once and correlates it with the keywords."""
+        unique_texts = list(dict.fromkeys(texts))
+        unique_index = {text: i for i, text in enumerate(unique_texts)}
+        embeddings = np.asarray(encoder(unique_texts), dtype=np.float32)
+        instrumentation.count('embedded_strings', len(unique_texts))
+        unique_scores = np.inner(keyword_embeddings, embeddings).max(axis=0)
+        return unique_scores[[unique_index[text] for text in texts]]
+
+    def _token_scores(self, doc: Doc) -> np.ndarray:
+        """Pre-scores every token by its word form, each distinct form embedded once."""
+        orths, inverse = np.unique(doc.to_array(ORTH), return_inverse=True)
+        form_scores = np.zeros(len(orths), dtype=np.float32)
+        for start in range(0, len(orths), self.prescore_batch_size):
+            forms = [doc.vocab.strings[int(orth)]
+                     for orth in orths[start:start + self.prescore_batch_size]]
+            form_scores[start:start + len(forms)] = self._score_texts(
+                self.prescore_encoder, self.prescore_keyword_embeddings, forms)
+        return form_scores[inverse.ravel()]
+
+    def correlate_spans(self, doc: Doc, n_gram_size: Union[int, List[int]]) -> int:
+        tagged_spans = []
+        tagged_scores = []
+        for starts, ends, scores in self.iter_n_gram_scores(doc, n_gram_size):
+            passed = scores > self.correlator.threshold
+            tagged_spans.extend(
+                doc[start:end] for start, end in zip(starts[passed], ends[passed]))
+            tagged_scores.extend(scores[passed])
+        self.stats['above_threshold'] = len(tagged_spans)
+        return self.correlator.tag_spans(doc, tagged_spans, tagged_scores)
+
+    def candidate_n_grams(self, doc: Doc, n_gram_size: Union[int, List[int]],
+                          prune: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """Generates the n-grams of a document that pass the candidate cascade
+
+        The number of n-grams generated and removed by every stage is stored
+        in self.stats.
+
+        Args:
+            doc (Doc): A spacy document that is being analyzed
+            n_gram_size (Union[int, List[int]]): number of tokens per n-gram, or several sizes
+            prune (bool): apply the cascade, otherwise all n-grams are candidates
+
+        Returns:
+            starts (np.ndarray): start token index of every candidate
+            ends (np.ndarray): end token index of every candidate
+        """
+        sizes = [n_gram_size] if isinstance(n_gram_size, int) else list(n_gram_size)
+        doc_len = len(doc)
+        stats = {'generated': 0}
+        stats.update({stage: 0 for stage in PRUNING_STAGES})
+
+        sentence_ids = allowed_counts = token_scores = None
+        if prune and self.sentence_bounded and doc.has_annotation('SENT_START'):
+            sentence_ids = np.cumsum(doc.to_array(SENT_START).astype(np.int64) == 1)
+        if prune and (self.prune_disallowed or self.prescore_encoder is not None):
+            allowed = token_allowed_array(doc)
+            allowed_counts = np.concatenate([[0], np.cumsum(allowed)])
+        if prune and self.prescore_encoder is not None:
+            token_scores = np.where(allowed, self._token_scores(doc), -np.inf)
+
+        all_starts, all_ends = [], []
+        for size in sizes:
+            starts = np.arange(max(doc_len - size + 1, 0), dtype=np.int64)
+            ends = starts + size
+            stats['generated'] += len(starts)
+            if sentence_ids is not None:
+                keep = sentence_ids[starts] == sentence_ids[ends - 1]
+                stats['sentence_boundary'] += int(len(starts) - keep.sum())
+                starts, ends = starts[keep], ends[keep]
+            if prune and self.prune_disallowed:
+                keep = allowed_counts[ends] > allowed_counts[starts]
+                stats['no_allowed_token'] += int(len(starts) - keep.sum())
+                starts, ends = starts[keep], ends[keep]
+            if token_scores is not None and len(starts):
+                # best allowed token of every n-gram
+                best = np.lib.stride_tricks.sliding_window_view(token_scores, size).max(axis=1)
+                keep = best[starts] >= self.prescore_threshold
+                stats['prescore'] += int(len(starts) - keep.sum())
+                starts, ends = starts[keep], ends[keep]
+            all_starts.append(starts)
+            all_ends.append(ends)
+
+        starts = np.concatenate(all_starts) if all_starts else np.zeros(0, dtype=np.int64)
+        ends = np.concatenate(all_ends) if all_ends else np.zeros(0, dtype=np.int64)
+        stats['scored'] = len(starts)
+        self.stats = stats
+        for stage in PRUNING_STAGES:
+            instrumentation.count('n_grams_pruned_' + stage, stats[stage])
+        return starts, ends
+
+    def iter_n_gram_scores(
+            self, doc: Doc,
+            n_gram_size: Union[int, List[int]],
+            prune: bool = True) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Scores the candidate n-grams of a document batch by batch
+
+        Args:
+            doc (Doc): A spacy document that is being analyzed
+            n_gram_size (Union[int, List[int]]): number of tokens per n-gram, or several sizes
+            prune (bool): apply the candidate cascade, otherwise all n-grams are scored
+
+        Returns (Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]):
+            for every batch, the start and end token indices of its n-grams and
+            their correlation to the keywords
+        """
+        all_starts, all_ends = self.candidate_n_grams(doc, n_gram_size, prune)
+        for batch_start in range(0, len(all_starts), self.batch_size):
+            starts = all_starts[batch_start:batch_start + self.batch_size]
+            ends = all_ends[batch_start:batch_start + self.batch_size]
+            with instrumentation.timer('score_n_grams'):
+                texts = [doc[start:end].text for start, end in zip(starts.tolist(), ends.tolist())]
+                scores = self._score_texts(self.encoder, self.keyword_embeddings, texts)
+            instrumentation.count('n_grams', len(starts))
+            yield starts, ends, scores
+
+    def pruning_recall(self, doc: Doc, n_gram_size: Union[int, List[int]]) -> Dict[str, float]:
+        """Compares the candidate cascade with scoring every n-gram
+
+        Both paths score their n-grams with the encoder; the recall is the
+        share of the n-grams above the threshold in the exhaustive path that
+        are also above it with the cascade. Running it embeds every n-gram of
+        the document, so it is meant for tuning prescore_threshold on a
+        sample document.
+
+        Args:
+            doc (Doc): A spacy document that is being analyzed
+            n_gram_size (Union[int, List[int]]): number of tokens per n-gram, or several sizes
+
+        Returns (Dict[str, float]):
+            the stage statistics of the cascade, 'exhaustive_hits', 'pruned_hits'
+            and 'recall'
+        """
+        def hits(prune):
+            found = set()
+            for starts, ends, scores in self.iter_n_gram_scores(doc, n_gram_size, prune):
+                passed = scores > self.correlator.threshold
+                found.update(zip(starts[passed].tolist(), ends[passed].tolist()))
+            return found
 
-    def __init__(self, keywords, threshold, tag) -> None:
-        self.correlator = SpanCorrelator(keywords, threshold, tag)
+        exhaustive = hits(prune=False)
+        pruned = hits(prune=True)
+        report = dict(self.stats)
+        report['exhaustive_hits'] = len(exhaustive)
+        report['pruned_hits'] = len(pruned & exhaustive)
+        report['recall'] = len(pruned & exhaustive) / len(exhaustive) if exhaustive else 1.0
+        return report
 
-    def correlate_spans(self, doc: Doc, n_gram_size):
-        n_gram_tuples = self.get_n_gram_tuples(n_gram_size, len(doc))
-        span_candidates = [doc[t[0]:t[1]] for t in n_gram_tuples]
-        self.correlator(doc, span_candidates)
+    def iter_n_gram_tuples(self, size, doc_len) -> Iterator[Tuple[int, int]]:
+        return ((i, i + size) for i in range(doc_len - size + 1))
 
     def get_n_gram_tuples(self, size, doc_len):
-        return [(i, i + size) for i in range(doc_len - size + 1)]
\ No newline at end of file
+        return list(self.iter_n_gram_tuples(size, doc_len))
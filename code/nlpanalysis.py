@@ -16,11 +16,11 @@ def calculate_topic_frequency_subset(document_frequency: Dict[str, int],
 
     Returns:
         word_frequencies (Dict[str, int]): A dictionary mapping topic-defined keywords to their
-            respective frequencies
+            respective frequencies, 0 for keywords that are not in the document
 
     """
     word_frequencies = {
-        word: document_frequency[word] for word in topic_to_keywords[topic]
+        word: document_frequency.get(word, 0) for word in topic_to_keywords[topic]
     }
 
     return word_frequencies
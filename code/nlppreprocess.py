@@ -4,15 +4,53 @@
 #https://realpython.com/natural-language-processing-spacy-python/#how-to-download-models-and-data
 
 import codecs
-import contractions
-import spacy
-from collections import OrderedDict
-from typing import List, Dict, Tuple
+import time
+import numpy as np
+import pandas as pd
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from spacy.attrs import IDX, IS_PUNCT, IS_SPACE, IS_STOP, LEMMA, LENGTH, LOWER, ORTH, SENT_START
+from spacy.tokens import Doc, Span
+from typing import List, Dict, Tuple, Iterator, Optional
+import instrumentation
+from doccache import DocCache, doc_cache_key
+from model_registry import get_spacy_model
+from textutils.chunked_reader import ChunkedTextReader
+from textutils.expander import ContractionExpander, OffsetMap
 
 
-# for multi-language: spacy.load('xx_ent_wiki_sm')
-nlp = spacy.load(
-    'en_core_web_sm')
+# for multi-language: 'xx_ent_wiki_sm'
+SPACY_MODEL = 'en_core_web_sm'
+
+
+def get_nlp() -> object:
+    """Returns the spacy pipeline used for preprocessing.
+
+    The model is loaded on first use and shared through the model registry.
+
+    Returns (object):
+        the spacy pipeline of SPACY_MODEL
+    """
+    return get_spacy_model(SPACY_MODEL)
+
+
+def __getattr__(name):
+    # nlp used to be loaded on import, it now comes from the model registry
+    if name == 'nlp':
+        return get_nlp()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Named pipeline profiles: which components of the loaded pipeline to switch off
+# (and which disabled-by-default ones to switch on) for a given analysis.
+# 'lemma' is enough for filter_modify_tokens, which only needs lemmas and stop
+# word flags, so the parser is replaced by the much cheaper sentence recognizer.
+PIPELINE_PROFILES = {
+    'full': {'disable': [], 'enable': []},
+    'lemma': {'disable': ['parser', 'ner'], 'enable': ['senter']},
+}
+
+# shared so the expansion of every word form is only computed once per process
+contraction_expander = ContractionExpander()
 
 def fix_contractions(document: str) -> str:
     """Expands text, such that potentially important words
@@ -26,17 +64,34 @@ def fix_contractions(document: str) -> str:
     """
 
     # read original contracted text
+    with instrumentation.timer('read_file'):
+        with codecs.open(document, errors="ignore", encoding="utf8") as f:
+            text = f.read()
+
+    # same as applying contractions.fix to every word and joining them with spaces
+    with instrumentation.timer('fix_contractions'):
+        expanded_text = contraction_expander.expand(text)
+    return expanded_text
+
+
+def fix_contractions_with_offsets(document: str) -> Tuple[str, OffsetMap]:
+    """Expands contractions like fix_contractions and keeps track of where the
+    expanded text came from, so character positions in it (e.g. token.idx of the
+    parsed document) can be mapped back into the original file.
+
+     Args:
+        document (str): input policy document to be analysed
+
+     Returns:
+        expanded_text (str): text with expanded contractions
+        offsets (OffsetMap): map from positions in expanded_text to positions in
+            the decoded text of the document
+    """
     with codecs.open(document, errors="ignore", encoding="utf8") as f:
         text = f.read()
 
-    # create empty list
-    expanded_words = []
-    for word in text.split():
-        # use contractions.fix to expand the shortened words
-        expanded_words.append(contractions.fix(word))
+    return contraction_expander.expand_with_offsets(text)
 
-    expanded_text = ' '.join(expanded_words)
-    return expanded_text
 
 def is_token_allowed(token: object) -> bool:
     """ Checks whether token in not a stop word or punctuation symbol.
@@ -53,6 +108,23 @@ def is_token_allowed(token: object) -> bool:
     return True
 
 
+def token_allowed_array(tokens: object) -> np.ndarray:
+    """ Checks is_token_allowed for all tokens of a document at once, from the token attribute arrays.
+
+    Args:
+        tokens (object): spacy Doc or Span
+
+    Returns (np.ndarray):
+        boolean mask, True for the tokens that are neither stop words, punctuation nor whitespace
+    """
+    if isinstance(tokens, Span):
+        doc, start, end = tokens.doc, tokens.start, tokens.end
+    else:
+        doc, start, end = tokens, 0, len(tokens)
+    is_stop, is_punct, is_space = doc.to_array([IS_STOP, IS_PUNCT, IS_SPACE])[start:end].T
+    return (is_stop == 0) & (is_punct == 0) & (is_space == 0)
+
+
 def preprocess_token(token: object) -> str:
     """ Computes the lowercase lemma form of the input token.
 
@@ -65,11 +137,95 @@ def preprocess_token(token: object) -> str:
     return token.lemma_.strip().lower()
 
 
-def preprocess_doc(doc_path: str) -> Tuple[object, List[object], List[object]]:
+@contextmanager
+def pipeline_profile(profile: str = 'full') -> Iterator[object]:
+    """Temporarily configures the shared nlp pipeline for a named profile.
+
+    Components listed under 'disable' are switched off and disabled components
+    listed under 'enable' are switched on; the pipeline is restored on exit.
+    Components that are not part of the loaded pipeline are ignored.
+
+    Example:
+        with pipeline_profile('lemma') as nlp:
+            tokens = nlp(text)
+
+    Args:
+        profile (str): a key of PIPELINE_PROFILES
+
+    Returns (object):
+        the configured spacy pipeline
+    """
+    if profile not in PIPELINE_PROFILES:
+        raise ValueError(f"Unknown pipeline profile '{profile}', "
+                         f"choose one of {list(PIPELINE_PROFILES)}")
+
+    nlp = get_nlp()
+    settings = PIPELINE_PROFILES[profile]
+    enabled = [name for name in settings['enable'] if name in nlp.disabled]
+    disabled = [name for name in settings['disable'] if name in nlp.pipe_names]
+    for name in enabled:
+        nlp.enable_pipe(name)
+    for name in disabled:
+        nlp.disable_pipe(name)
+    try:
+        yield nlp
+    finally:
+        for name in disabled:
+            nlp.enable_pipe(name)
+        for name in enabled:
+            nlp.disable_pipe(name)
+
+
+def split_doc(tokens: object) -> Tuple[object, List[object], List[object]]:
+    """Splits a parsed document into the outputs of preprocess_doc.
+
+    Args:
+        tokens (object): spacy document
+
+    Returns:
+        tokens (object): word tokens
+        token_list (List[object]): list of the word tokens
+        sentences (List[object]): sentence tokens
+    """
+    token_list = [token for token in tokens]
+
+    # sentence tokens
+    sentences = list(tokens.sents)
+    return tokens, token_list, sentences
+
+
+def cache_key_for(doc_path: str, profile: str, raw_text: Optional[bytes] = None) -> str:
+    """Computes the DocCache key of a document preprocessed with a pipeline profile.
+
+    Args:
+        doc_path (str): path to the input document
+        profile (str): name of the pipeline profile (see PIPELINE_PROFILES)
+        raw_text (Optional[bytes]): raw content of the document if it was read already
+
+    Returns (str):
+        cache key of the parsed document
+    """
+    if raw_text is None:
+        with open(doc_path, 'rb') as f:
+            raw_text = f.read()
+    options = {
+        'fix_contractions': True,
+        'profile': profile,
+        'components': PIPELINE_PROFILES[profile],
+    }
+    return doc_cache_key(raw_text, get_nlp(), options)
+
+
+def preprocess_doc(doc_path: str,
+                   profile: str = 'full',
+                   cache: Optional[DocCache] = None) -> Tuple[object, List[object], List[object]]:
     """Applies NLP framework to a document.
 
     Args:
         doc_path (str): path to the input document
+        profile (str): name of the pipeline profile to run (see PIPELINE_PROFILES)
+        cache (Optional[DocCache]): cache of parsed documents, the document is
+            only parsed if it is not found in there
 
     Returns:
         tokens (object): word tokens
@@ -79,13 +235,309 @@ def preprocess_doc(doc_path: str) -> Tuple[object, List[object], List[object]]:
 
     # TODO: check functionality and output of spacy (nlp) and potentially condense functions
 
+    nlp = get_nlp()
+    instrumentation.count('docs')
+    if cache is not None:
+        key = cache_key_for(doc_path, profile)
+        tokens = cache.get(key, nlp.vocab)
+        if tokens is not None:
+            instrumentation.count('doc_cache_hits')
+            instrumentation.count('tokens', len(tokens))
+            return split_doc(tokens)
+
     # remove contracted words and tokenize the document
-    tokens = nlp(fix_contractions(doc_path))
-    token_list = [token for token in tokens]
+    with instrumentation.profiling(doc_path), pipeline_profile(profile):
+        text = fix_contractions(doc_path)
+        with instrumentation.timer('parse'):
+            tokens = nlp(text)
+    instrumentation.count('tokens', len(tokens))
+    instrumentation.count('parsed_tokens', len(tokens))
+
+    if cache is not None:
+        cache.put(key, tokens)
+    return split_doc(tokens)
+
+
+def preprocess_doc_chunks(doc_path: str,
+                          profile: str = 'full',
+                          chunk_chars: int = 100000,
+                          align: str = 'paragraph',
+                          batch_size: int = 4) -> Iterator[Tuple[Doc, int, np.ndarray]]:
+    """Applies NLP framework to a document of any size, chunk by chunk.
+
+    The document is streamed with textutils.chunked_reader.ChunkedTextReader
+    in paragraph (or sentence) aligned chunks, the contractions of every
+    chunk are expanded and the chunks are parsed with nlp.pipe, so memory
+    stays bounded by the chunk size and documents longer than nlp.max_length
+    can be processed. Positions of the chunk documents are translated to the
+    whole document: the index of a token in the document is token_offset +
+    token.i, its character position in the decoded file is source_idx[token.i].
+
+    Example:
+        for tokens, token_offset, source_idx in preprocess_doc_chunks(doc_path):
+            for ent in tokens.ents:
+                print(ent.text, token_offset + ent.start, source_idx[ent.start])
 
-    # sentence tokens
-    sentences = list(tokens.sents)
-    return tokens, token_list, sentences
+    Args:
+        doc_path (str): path to the input document
+        profile (str): name of the pipeline profile to run (see PIPELINE_PROFILES)
+        chunk_chars (int): largest number of characters of a chunk
+        align (str): where chunks end, 'paragraph' or 'sentence'
+        batch_size (int): number of chunks sent to the pipeline at a time
+
+    Returns (Iterator[Tuple[Doc, int, np.ndarray]]):
+        for every chunk, its parsed tokens, the index of its first token in
+        the whole document, and the character position of every token in the
+        decoded text of the file
+    """
+    nlp = get_nlp()
+    if chunk_chars >= nlp.max_length:
+        raise ValueError(f"chunk_chars has to be below nlp.max_length ({nlp.max_length})")
+    instrumentation.count('docs')
+
+    def expanded_chunks():
+        for start, text in ChunkedTextReader(doc_path, chunk_chars, align):
+            with instrumentation.timer('fix_contractions'):
+                expanded_text, offsets = contraction_expander.expand_with_offsets(text)
+            yield expanded_text, (start, offsets)
+
+    token_offset = 0
+    with pipeline_profile(profile):
+        for tokens, (start, offsets) in nlp.pipe(expanded_chunks(), as_tuples=True,
+                                                 batch_size=batch_size):
+            source_idx = start + np.asarray(offsets.to_source(tokens.to_array(IDX)), dtype=np.int64)
+            instrumentation.count('tokens', len(tokens))
+            yield tokens, token_offset, source_idx
+            token_offset += len(tokens)
+
+
+def _expand_raw_text(raw_text: bytes) -> str:
+    """Decodes the raw content of a document and expands its contractions like fix_contractions."""
+    with instrumentation.timer('fix_contractions'):
+        return contraction_expander.expand(raw_text.decode('utf8', errors='ignore'))
+
+
+def iter_preprocess_corpus(
+        doc_df: pd.DataFrame,
+        profile: str = 'full',
+        batch_size: int = 4,
+        n_process: int = 1,
+        cache: Optional[DocCache] = None) -> Iterator[Tuple[int, Tuple[object, List[object], List[object]]]]:
+    """Applies NLP framework to all documents of a corpus, one document at a time.
+
+    Every file is read once: its raw content gives the cache key and, if the
+    document is not cached, the text sent through nlp.pipe. Texts are fed to
+    the pipeline as they are read and the parsed documents are handed out as
+    they come out of it, so only the documents of the batches in flight are
+    held in memory. A document chosen with instrumentation.profile_document is
+    parsed on its own, so its cProfile capture does not include other
+    documents. The 'parse' timer only covers the pipeline, and together with
+    the 'parsed_tokens' counter gives the parsing throughput.
+
+    Example:
+        for i, (tokens, token_list, sentences) in iter_preprocess_corpus(policy_doc_df, profile='lemma'):
+            print(policy_doc_df['policy_doc_paths'].iloc[i], len(tokens))
+
+    Args:
+        doc_df (pd.DataFrame): document table as returned by datahelper.read_docs_to_df
+        profile (str): name of the pipeline profile to run (see PIPELINE_PROFILES)
+        batch_size (int): number of documents sent to the pipeline at a time
+        n_process (int): number of processes to parse with
+        cache (Optional[DocCache]): cache of parsed documents
+
+    Returns (Iterator[Tuple[int, Tuple[object, List[object], List[object]]]]):
+        for every document in the row order of doc_df, its row number and the
+        (tokens, token_list, sentences) output of preprocess_doc
+    """
+    nlp = get_nlp()
+    doc_paths = list(doc_df['policy_doc_paths'])
+    instrumentation.count('docs', len(doc_paths))
+    # documents not sent through nlp.pipe: (row, cache key, raw content of a profiled document)
+    skipped = deque()
+    read_s = 0.0
+
+    def texts():
+        nonlocal read_s
+        for i, doc_path in enumerate(doc_paths):
+            start = time.perf_counter()
+            with instrumentation.timer('read_file'):
+                with open(doc_path, 'rb') as f:
+                    raw_text = f.read()
+            key = None if cache is None else cache_key_for(doc_path, profile, raw_text)
+            if key is not None and key in cache:
+                skipped.append((i, key, None))
+            elif instrumentation.is_profiled(doc_path):
+                skipped.append((i, key, raw_text))
+            else:
+                text = _expand_raw_text(raw_text)
+                read_s += time.perf_counter() - start
+                yield text, (i, key)
+                continue
+            read_s += time.perf_counter() - start
+
+    def parse_alone(i, raw_text):
+        if raw_text is None:
+            # evicted since it was looked up
+            with open(doc_paths[i], 'rb') as f:
+                raw_text = f.read()
+        with instrumentation.profiling(doc_paths[i]):
+            text = _expand_raw_text(raw_text)
+            with instrumentation.timer('parse'):
+                tokens = nlp(text)
+        return tokens
+
+    def finish(i, key, tokens, parsed):
+        instrumentation.count('tokens', len(tokens))
+        if parsed:
+            instrumentation.count('parsed_tokens', len(tokens))
+            if cache is not None:
+                cache.put(key, tokens)
+        return i, split_doc(tokens)
+
+    def skipped_docs(before):
+        while skipped and skipped[0][0] < before:
+            i, key, raw_text = skipped.popleft()
+            tokens = cache.get(key, nlp.vocab) if raw_text is None else None
+            if tokens is not None:
+                instrumentation.count('doc_cache_hits')
+                yield finish(i, key, tokens, False)
+            else:
+                yield finish(i, key, parse_alone(i, raw_text), True)
+
+    with pipeline_profile(profile):
+        docs = nlp.pipe(texts(), as_tuples=True, batch_size=batch_size, n_process=n_process)
+        while True:
+            start, read_before = time.perf_counter(), read_s
+            try:
+                tokens, (i, key) = next(docs)
+            except StopIteration:
+                break
+            if instrumentation.is_enabled():
+                # reading and expanding the texts fed to the pipeline have timers of their own
+                parse_s = time.perf_counter() - start - (read_s - read_before)
+                instrumentation.get_stats().add_time('parse', parse_s)
+            yield from skipped_docs(i)
+            yield finish(i, key, tokens, True)
+        yield from skipped_docs(len(doc_paths))
+
+
+def preprocess_corpus(
+        doc_df: pd.DataFrame,
+        profile: str = 'full',
+        batch_size: int = 4,
+        n_process: int = 1,
+        cache: Optional[DocCache] = None) -> List[Tuple[object, List[object], List[object]]]:
+    """Applies NLP framework to all documents of a corpus in batches.
+
+    The documents are streamed through nlp.pipe, optionally spread over several
+    processes (see iter_preprocess_corpus). With a cache, documents parsed in an
+    earlier run are loaded instead and only the remaining ones are sent through
+    the pipeline. With instrumentation enabled, the throughput of the run is
+    the 'parsed_tokens' counter over the total time of the 'parse' timer.
+
+    Example:
+        policy_doc_df = read_docs_to_df('../test_resources/data')
+        parsed_docs = preprocess_corpus(policy_doc_df, profile='lemma', n_process=4)
+        tokens, token_list, sentences = parsed_docs[0]
+
+    Args:
+        doc_df (pd.DataFrame): document table as returned by datahelper.read_docs_to_df
+        profile (str): name of the pipeline profile to run (see PIPELINE_PROFILES)
+        batch_size (int): number of documents sent to the pipeline at a time
+        n_process (int): number of processes to parse with
+        cache (Optional[DocCache]): cache of parsed documents
+
+    Returns (List[Tuple[object, List[object], List[object]]]):
+        the (tokens, token_list, sentences) output of preprocess_doc for every
+        document, in the row order of doc_df
+    """
+    parsed_docs = [None] * len(doc_df)
+    for i, parsed in iter_preprocess_corpus(doc_df, profile, batch_size, n_process, cache):
+        parsed_docs[i] = parsed
+    return parsed_docs
+
+
+def filter_token_array(tokens: object,
+                       remove_stop_punct: bool = True,
+                       lemmatize: bool = True,
+                       max_length: Optional[int] = None) -> Tuple[Doc, np.ndarray]:
+    """Filters and normalizes tokens in a single pass over the token attribute arrays.
+
+    The token attributes are read with Doc.to_array and filtered with NumPy
+    masks, and the filtered document is built directly from the kept
+    (lowercase lemma or lowercase text) forms, without tokenizing or parsing
+    the text a second time. Whitespace tokens and tokens without a lemma are
+    always removed. Sentence boundaries of the input carry over: a filtered
+    token starts a sentence if it is the first kept token of its sentence.
+
+    Example:
+        filtered_tokens, source_i = filter_token_array(tokens)
+        tokens[source_i[5]]  # original token behind filtered_tokens[5]
+
+        # equivalent of the notebooks' make_window_text(tokens, max_length=25)
+        window_tokens, source_i = filter_token_array(
+            tokens, remove_stop_punct=False, lemmatize=False, max_length=25)
+
+    Args:
+        tokens (object): spacy Doc, Span or list of tokens of one document
+        remove_stop_punct (bool): drop stop words and punctuation (see is_token_allowed)
+        lemmatize (bool): keep the lowercase lemma, otherwise the lowercase text
+        max_length (Optional[int]): drop tokens with max_length or more characters
+
+    Returns:
+        filtered_tokens (Doc): document made of the kept token forms
+        source_i (np.ndarray): index in the original document of every filtered token
+    """
+    with instrumentation.timer('filter_tokens'):
+        return _filter_token_array(tokens, remove_stop_punct, lemmatize, max_length)
+
+
+def _filter_token_array(tokens: object, remove_stop_punct: bool, lemmatize: bool,
+                        max_length: Optional[int]) -> Tuple[Doc, np.ndarray]:
+    if isinstance(tokens, Doc):
+        doc, source_i = tokens, np.arange(len(tokens))
+    elif isinstance(tokens, Span):
+        doc, source_i = tokens.doc, np.arange(tokens.start, tokens.end)
+    elif len(tokens) > 0:
+        doc, source_i = tokens[0].doc, np.array([token.i for token in tokens])
+    else:
+        return Doc(get_nlp().vocab, words=[]), np.zeros(0, dtype=np.int64)
+
+    form_attr = LEMMA if lemmatize else LOWER
+    attrs = doc.to_array([IS_STOP, IS_PUNCT, IS_SPACE, LENGTH, form_attr])[source_i]
+    is_stop, is_punct, is_space, length, forms = attrs.T
+
+    keep = (is_space == 0) & (forms != 0)
+    if remove_stop_punct:
+        keep &= (is_stop == 0) & (is_punct == 0)
+    if max_length is not None:
+        keep &= length < max_length
+
+    # normalize every distinct form once instead of once per token
+    unique_forms, inverse = np.unique(forms[keep], return_inverse=True)
+    normalized = [doc.vocab.strings[int(form)].strip().lower() for form in unique_forms]
+    non_empty = np.array([len(form) > 0 for form in normalized], dtype=bool)
+    kept_i = np.flatnonzero(keep)[non_empty[inverse]]
+    words = np.array(normalized, dtype=object)[inverse[non_empty[inverse]]].tolist()
+
+    filtered_tokens = Doc(doc.vocab,
+                          words=words,
+                          spaces=[True] * (len(words) - 1) + [False] * bool(words))
+    if not words:
+        return filtered_tokens, source_i[kept_i]
+
+    # the filtered forms are their own lemmas
+    new_attrs = [LEMMA]
+    new_values = [filtered_tokens.to_array(ORTH)]
+    if doc.has_annotation('SENT_START'):
+        sentence_ids = np.cumsum(doc.to_array(SENT_START).astype(np.int64) == 1)
+        kept_sentences = sentence_ids[source_i[kept_i]]
+        sent_starts = np.where(np.diff(kept_sentences, prepend=-1) != 0, 1, -1)
+        new_attrs.append(SENT_START)
+        new_values.append(sent_starts.astype(np.uint64))
+    filtered_tokens.from_array(new_attrs, np.stack(new_values, axis=1))
+
+    return filtered_tokens, source_i[kept_i]
 
 
 def filter_modify_tokens(tokens: List[object]) -> List[object]:
@@ -93,6 +545,9 @@ def filter_modify_tokens(tokens: List[object]) -> List[object]:
     and generates a list of filtered tokens that we then convert into a filtered text and
     collection of filtered tokens.
 
+    The filtering itself is done by filter_token_array, so the document is not
+    run through nlp() a second time.
+
     Args:
         tokens (List[object]): list of input tokens
 
@@ -104,12 +559,7 @@ def filter_modify_tokens(tokens: List[object]) -> List[object]:
     # may want to find some important accronyms too (so maybe modify this function later)
 
     # filter tokens, and make lowercase and lemmatize:
-    filtered_text_list = [
-        preprocess_token(token) for token in tokens if is_token_allowed(token)
-    ]
-
-    filtered_text = ' '.join(filtered_text_list)
-    filtered_tokens = nlp(filtered_text)
+    filtered_tokens, _ = filter_token_array(tokens)
     return filtered_tokens
 
 
@@ -133,7 +583,7 @@ def make_filtered_tokens_from_ndc(ndc_dict: Dict) -> Dict[str, List[str]]:
 
         # add keywords from topic (key) to list of values and tokenize those values
         keywords.append(topic)
-        keywords_tokens = nlp(' '.join(keywords))
+        keywords_tokens = get_nlp()(' '.join(keywords))
 
         # generate a filtered list of keywords
         # using the same token preprocessing we use in the documents
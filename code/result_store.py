@@ -0,0 +1,270 @@
+"""Columnar result store for GIZ-Policy
+
+Analysis results (keyword hits, NDC word positions, SDG counts per window,
+...) are collected row by row in typed column buffers and written as Parquet
+files partitioned by country and document, instead of growing a DataFrame
+with pd.concat in a loop and writing it as tab-separated text. Topic and
+keyword like columns are dictionary encoded. Reading only touches the
+requested columns and partitions. The document table of read_docs_to_df is
+stored next to the results and joins on the country and document columns.
+
+Layout of a store:
+    <root_dir>/documents.parquet
+    <root_dir>/<table>/country=<country>/document=<document>/part-<n>.parquet
+
+    Typical usage example:
+
+    write_documents(policy_doc_df, '../results', country='South Africa')
+    with ResultWriter('../results', 'ndc_hits', NDC_HIT_COLUMNS) as writer:
+        for topic, keyword, start, end in matcher.find(text):
+            writer.append('South Africa', doc_name, topic=topic, keyword=keyword,
+                          start=start, end=end)
+
+    hits = read_results('../results', 'ndc_hits', columns=['topic', 'start'],
+                        countries=['South Africa'])
+    hits.merge(read_documents('../results'), on=['country', 'document'])
+"""
+
+import os
+from array import array
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PARTITION_COLUMNS = ['country', 'document']
+
+# column type -> (buffer type code of array.array, arrow type); None buffers in a list
+COLUMN_TYPES = {
+    'int': ('q', pa.int64()),
+    'float': ('d', pa.float64()),
+    'bool': ('b', pa.bool_()),
+    'str': (None, pa.string()),
+    'category': (None, pa.dictionary(pa.int32(), pa.string())),
+}
+
+NDC_HIT_COLUMNS = {'topic': 'category', 'keyword': 'category', 'start': 'int', 'end': 'int'}
+
+_PARTITIONING = ds.partitioning(pa.schema([(name, pa.string()) for name in PARTITION_COLUMNS]),
+                                flavor='hive')
+
+
+def _partition_dir(root_dir: str, table: str, country: str, document: str) -> str:
+    return os.path.join(root_dir, table, 'country=' + quote(country, safe=''),
+                        'document=' + quote(document, safe=''))
+
+
+class ResultWriter:
+    """Collects result rows in typed column buffers and writes them as partitioned Parquet
+
+    Rows are buffered until buffer_rows of them are collected (or the writer
+    is closed) and then written with one Parquet file per country and
+    document. The first write of a document replaces the results an earlier
+    run stored for it, so processing a document again does not duplicate its
+    rows. The files of a document are numbered in the order they are
+    written, so read_results returns its rows in the order they were added.
+
+    Example:
+        with ResultWriter('../results', 'sdg_windows', {'window': 'int', 'topic': 'category',
+                                                         'count': 'int'}) as writer:
+            writer.extend('South Africa', doc_name, {'window': windows, 'topic': topics,
+                                                     'count': counts})
+
+    Args:
+        root_dir (str): folder of the result store
+        table (str): name of the result table
+        columns (Dict[str, str]): name and type of every column, the types
+            are the keys of COLUMN_TYPES
+        buffer_rows (int): number of rows collected before they are written
+    """
+
+    def __init__(self, root_dir: str, table: str, columns: Dict[str, str],
+                 buffer_rows: int = 100000) -> None:
+        unknown = {name: kind for name, kind in columns.items() if kind not in COLUMN_TYPES}
+        if unknown:
+            raise ValueError(f"Unknown column types {unknown}, use one of {list(COLUMN_TYPES)}")
+        reserved = set(columns) & set(PARTITION_COLUMNS)
+        if reserved:
+            raise ValueError(f"{sorted(reserved)} are partition columns and are set per row")
+
+        self.root_dir = root_dir
+        self.table = table
+        self.columns = columns
+        self.buffer_rows = buffer_rows
+        self.schema = pa.schema([(name, COLUMN_TYPES[kind][1]) for name, kind in columns.items()])
+        self.rows_written = 0
+        # number of files written per (country, document) partition
+        self._written_parts: Dict[tuple, int] = {}
+        self._reset_buffers()
+
+    def _reset_buffers(self) -> None:
+        self._countries: List[str] = []
+        self._documents: List[str] = []
+        self._buffers = {}
+        for name, kind in self.columns.items():
+            typecode = COLUMN_TYPES[kind][0]
+            self._buffers[name] = [] if typecode is None else array(typecode)
+
+    def append(self, country: str, document: str, **row) -> None:
+        """Adds one result row.
+
+        Args:
+            country (str): country the document belongs to
+            document (str): name of the document (index of the document table)
+            **row: a value for every column
+        """
+        for name, buffer in self._buffers.items():
+            buffer.append(row[name])
+        self._countries.append(country)
+        self._documents.append(document)
+        if len(self._countries) >= self.buffer_rows:
+            self.flush()
+
+    def extend(self, country: str, document: str, columns: Dict[str, Iterable]) -> None:
+        """Adds the result rows of a document given column by column.
+
+        Args:
+            country (str): country the document belongs to
+            document (str): name of the document (index of the document table)
+            columns (Dict[str, Iterable]): the values of every column, of equal lengths
+        """
+        n_rows = None
+        for name, buffer in self._buffers.items():
+            values = columns[name]
+            values = values.tolist() if isinstance(values, np.ndarray) else list(values)
+            if n_rows is not None and len(values) != n_rows:
+                raise ValueError(f"Column {name} has {len(values)} values, expected {n_rows}")
+            n_rows = len(values)
+            buffer.extend(values)
+        self._countries.extend([country] * n_rows)
+        self._documents.extend([document] * n_rows)
+        if len(self._countries) >= self.buffer_rows:
+            self.flush()
+
+    def _buffer_table(self) -> pa.Table:
+        arrays = []
+        for name, kind in self.columns.items():
+            buffer = self._buffers[name]
+            if kind == 'category':
+                arrays.append(pa.array(buffer, pa.string()).dictionary_encode())
+            elif isinstance(buffer, array):
+                values = np.frombuffer(buffer, dtype=buffer.typecode)
+                arrays.append(pa.array(values.astype(bool) if kind == 'bool' else values,
+                                       COLUMN_TYPES[kind][1]))
+            else:
+                arrays.append(pa.array(buffer, COLUMN_TYPES[kind][1]))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def flush(self) -> None:
+        """Writes the buffered rows, one file per country and document."""
+        if not self._countries:
+            return
+        table = self._buffer_table()
+        partitions = pd.MultiIndex.from_arrays([self._countries, self._documents])
+        codes, keys = pd.factorize(partitions)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.flatnonzero(np.diff(codes[order], prepend=-1, append=-1))
+
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            country, document = keys[codes[order[start]]]
+            partition_dir = _partition_dir(self.root_dir, self.table, country, document)
+            part = self._written_parts.get((country, document), 0)
+            if part == 0:
+                # results of an earlier run of this document are replaced
+                if os.path.isdir(partition_dir):
+                    for name in os.listdir(partition_dir):
+                        os.remove(os.path.join(partition_dir, name))
+                os.makedirs(partition_dir, exist_ok=True)
+            # zero padded, the dataset reads the files in lexicographic order
+            pq.write_table(table.take(order[start:end]),
+                           os.path.join(partition_dir, f'part-{part:06d}.parquet'))
+            self._written_parts[(country, document)] = part + 1
+
+        self.rows_written += len(self._countries)
+        self._reset_buffers()
+
+    def close(self) -> None:
+        """Writes the remaining buffered rows."""
+        self.flush()
+
+    def __enter__(self) -> 'ResultWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+def read_results(root_dir: str,
+                 table: str,
+                 columns: Optional[List[str]] = None,
+                 countries: Optional[List[str]] = None,
+                 documents: Optional[List[str]] = None) -> pd.DataFrame:
+    """Reads (part of) a result table.
+
+    Only the files of the selected partitions are opened, and only the
+    selected columns are read from them. Dictionary encoded columns become
+    categorical columns.
+
+    Args:
+        root_dir (str): folder of the result store
+        table (str): name of the result table
+        columns (Optional[List[str]]): columns to read, including the partition
+            columns country and document; all columns if None
+        countries (Optional[List[str]]): countries to read, all if None
+        documents (Optional[List[str]]): documents to read, all if None
+
+    Returns (pd.DataFrame):
+        the selected results
+    """
+    dataset = ds.dataset(os.path.join(root_dir, table), format='parquet', partitioning=_PARTITIONING)
+    selection = None
+    for name, values in (('country', countries), ('document', documents)):
+        if values is not None:
+            condition = ds.field(name).isin(list(values))
+            selection = condition if selection is None else selection & condition
+    return dataset.to_table(columns=columns, filter=selection).to_pandas()
+
+
+def write_documents(doc_df: pd.DataFrame, root_dir: str, country: str) -> None:
+    """Stores the document table of a corpus next to the results.
+
+    The rows of documents stored before are replaced, documents of other
+    countries are kept.
+
+    Args:
+        doc_df (pd.DataFrame): document table as returned by datahelper.read_docs_to_df
+        root_dir (str): folder of the result store
+        country (str): country of the documents
+    """
+    documents = pd.DataFrame({
+        'country': country,
+        'document': doc_df.index.astype(str),
+    })
+    for column in doc_df.columns:
+        documents[column] = doc_df[column].astype(str).to_numpy()
+
+    os.makedirs(root_dir, exist_ok=True)
+    path = os.path.join(root_dir, 'documents.parquet')
+    if os.path.exists(path):
+        stored = pd.read_parquet(path)
+        replaced = stored.set_index(['country', 'document']).index.isin(
+            documents.set_index(['country', 'document']).index)
+        documents = pd.concat([stored[~replaced], documents], ignore_index=True)
+    documents.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+
+def read_documents(root_dir: str) -> pd.DataFrame:
+    """Reads the document table of a result store.
+
+    Args:
+        root_dir (str): folder of the result store
+
+    Returns (pd.DataFrame):
+        country, document and the columns of read_docs_to_df for every document
+    """
+    return pd.read_parquet(os.path.join(root_dir, 'documents.parquet'))
@@ -0,0 +1,199 @@
+"""Sparse document-term matrix of a corpus
+
+The filtered lemmas of all documents are counted into one scipy.sparse CSR
+matrix (documents x corpus vocabulary), and the keyword sets of the topics
+into a sparse keyword-topic matrix over the same vocabulary. The keyword
+frequencies of every topic in every document then come from one sparse
+matrix product instead of a Python loop per document and topic; keywords
+that never occur count as 0. Both matrices can be saved as .npz files
+(DocumentTermMatrix.save with the vocabulary and document names,
+scipy.sparse.save_npz for the keyword-topic matrix), so reports can be made
+again without preprocessing the corpus.
+
+    Typical usage example:
+
+    parsed_docs = preprocess_corpus(policy_doc_df, profile='lemma')
+    filtered_docs = [filter_modify_tokens(tokens) for tokens, _, _ in parsed_docs]
+    dtm = DocumentTermMatrix.from_docs(filtered_docs, list(policy_doc_df.index))
+    ndc_dict_processed = make_filtered_tokens_from_ndc(ndc_dict)
+    topic_frequencies = dtm.topic_frequencies(ndc_dict_processed)  # documents x topics
+    keyword_frequencies = dtm.keyword_frequencies(ndc_dict_processed, 'climate change')
+    dtm.save('../results/south_africa_dtm.npz')
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from spacy.attrs import ORTH
+from spacy.tokens import Doc
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+
+def keyword_topic_matrix(topic_to_keywords: Dict[str, List[str]],
+                         vocabulary: Sequence[str]) -> sp.csr_matrix:
+    """Builds the sparse keyword-topic matrix of topic keyword sets.
+
+    Args:
+        topic_to_keywords (Dict[str, List[str]]): a mapping of all topics to their
+            keywords, processed like the documents (see make_filtered_tokens_from_ndc)
+        vocabulary (Sequence[str]): the terms of the matrix rows
+
+    Returns (sp.csr_matrix):
+        (len(vocabulary), len(topic_to_keywords)) matrix, 1 where a term is a
+        keyword of a topic; keywords missing from the vocabulary are left out
+    """
+    term_index = {term: i for i, term in enumerate(vocabulary)}
+    rows, columns = [], []
+    for topic_i, keywords in enumerate(topic_to_keywords.values()):
+        for keyword in keywords:
+            term_i = term_index.get(keyword)
+            if term_i is not None:
+                rows.append(term_i)
+                columns.append(topic_i)
+    matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, columns)),
+                           shape=(len(vocabulary), len(topic_to_keywords)))
+    # a keyword listed twice under a topic is counted once
+    matrix.data[:] = 1
+    return matrix
+
+
+def _pack_strings(strings: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Encodes strings as their concatenated utf8 bytes and the byte length of each."""
+    encoded = [str(string).encode('utf8') for string in strings]
+    return {'bytes': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            'lengths': np.array([len(string) for string in encoded], dtype=np.int64)}
+
+
+def _unpack_strings(encoded: np.ndarray, lengths: np.ndarray) -> List[str]:
+    """Decodes the output of _pack_strings."""
+    ends = np.cumsum(lengths).tolist()
+    data = encoded.tobytes()
+    return [data[end - length:end].decode('utf8') for end, length in zip(ends, lengths.tolist())]
+
+
+class DocumentTermMatrix:
+    """Term counts of the documents of a corpus in a sparse CSR matrix
+
+    Args:
+        matrix (sp.csr_matrix): (documents, terms) matrix of term counts
+        vocabulary (List[str]): the term of every column, sorted
+        documents (List[str]): the name of every row
+    """
+
+    def __init__(self, matrix: sp.csr_matrix, vocabulary: List[str], documents: List[str]) -> None:
+        if matrix.shape != (len(documents), len(vocabulary)):
+            raise ValueError(f"Matrix of shape {matrix.shape} does not fit {len(documents)} "
+                             f"documents and {len(vocabulary)} terms")
+        self.matrix = matrix.tocsr()
+        self.vocabulary = list(vocabulary)
+        self.documents = list(documents)
+        self.term_index = {term: i for i, term in enumerate(self.vocabulary)}
+
+    @classmethod
+    def from_docs(cls, docs: Sequence[Union[Doc, Iterable[str]]],
+                  documents: Optional[List[str]] = None) -> 'DocumentTermMatrix':
+        """Counts the terms of filtered documents.
+
+        Args:
+            docs (Sequence[Union[Doc, Iterable[str]]]): the filtered tokens of every
+                document (filter_modify_tokens or filter_token_array output), or
+                lists of term strings
+            documents (Optional[List[str]]): name of every document, its position if None
+
+        Returns (DocumentTermMatrix):
+            the counts of every term of the corpus in every document
+        """
+        if documents is None:
+            documents = [str(i) for i in range(len(docs))]
+        if len(documents) != len(docs):
+            raise ValueError(f"{len(docs)} documents but {len(documents)} document names")
+
+        term_index: Dict[str, int] = {}
+        columns = []
+        for doc in docs:
+            if isinstance(doc, Doc):
+                # look up the string of every distinct term once, not once per token
+                orths, inverse = np.unique(doc.to_array(ORTH), return_inverse=True)
+                terms = [doc.vocab.strings[int(orth)] for orth in orths]
+            else:
+                terms, inverse = np.unique(np.array(list(doc), dtype=object), return_inverse=True)
+            ids = np.array([term_index.setdefault(term, len(term_index)) for term in terms], dtype=np.int64)
+            columns.append(ids[inverse.ravel()])
+        rows = np.repeat(np.arange(len(docs)), [len(ids) for ids in columns])
+        columns = np.concatenate(columns) if columns else np.zeros(0, dtype=np.int64)
+
+        # columns in alphabetical order of the terms
+        vocabulary = sorted(term_index)
+        rank = np.empty(len(term_index), dtype=np.int64)
+        rank[[term_index[term] for term in vocabulary]] = np.arange(len(vocabulary))
+        matrix = sp.csr_matrix((np.ones(len(columns), dtype=np.int64), (rows, rank[columns])),
+                               shape=(len(docs), len(vocabulary)))
+        matrix.sum_duplicates()
+        return cls(matrix, vocabulary, documents)
+
+    def keyword_topic_matrix(self, topic_to_keywords: Dict[str, List[str]]) -> sp.csr_matrix:
+        """Builds the keyword-topic matrix of topic keyword sets over this vocabulary, see keyword_topic_matrix."""
+        return keyword_topic_matrix(topic_to_keywords, self.vocabulary)
+
+    def topic_frequencies(self, topic_to_keywords: Dict[str, List[str]]) -> pd.DataFrame:
+        """Counts the keywords of every topic in every document.
+
+        Args:
+            topic_to_keywords (Dict[str, List[str]]): a mapping of all topics to their
+                keywords, processed like the documents (see make_filtered_tokens_from_ndc)
+
+        Returns (pd.DataFrame):
+            documents x topics table of the summed keyword frequencies
+        """
+        counts = self.matrix @ self.keyword_topic_matrix(topic_to_keywords)
+        return pd.DataFrame(counts.toarray(), index=self.documents, columns=list(topic_to_keywords))
+
+    def keyword_frequencies(self, topic_to_keywords: Dict[str, List[str]], topic: str) -> pd.DataFrame:
+        """Counts the keywords of a topic in every document, as calculate_topic_frequency_subset.
+
+        Args:
+            topic_to_keywords (Dict[str, List[str]]): a mapping of all topics to their keywords
+            topic (str): the topic for which to find keyword frequencies
+
+        Returns (pd.DataFrame):
+            documents x keywords table, 0 for keywords that do not occur
+        """
+        keywords = list(dict.fromkeys(topic_to_keywords[topic]))
+        term_i = np.array([self.term_index.get(keyword, -1) for keyword in keywords], dtype=np.int64)
+        frequencies = np.zeros((len(self.documents), len(keywords)), dtype=np.int64)
+        found = term_i >= 0
+        frequencies[:, found] = self.matrix[:, term_i[found]].toarray()
+        return pd.DataFrame(frequencies, index=self.documents, columns=keywords)
+
+    def save(self, path: str) -> None:
+        """Saves the matrix with its vocabulary and document names.
+
+        Args:
+            path (str): .npz file to write
+        """
+        # fixed width unicode arrays would drop trailing NUL characters, so the
+        # strings are stored as utf8 bytes with their lengths
+        vocabulary = _pack_strings(self.vocabulary)
+        documents = _pack_strings(self.documents)
+        np.savez_compressed(path, data=self.matrix.data, indices=self.matrix.indices,
+                            indptr=self.matrix.indptr, shape=np.array(self.matrix.shape),
+                            vocabulary=vocabulary['bytes'], vocabulary_lengths=vocabulary['lengths'],
+                            documents=documents['bytes'], documents_lengths=documents['lengths'])
+
+    @classmethod
+    def load(cls, path: str) -> 'DocumentTermMatrix':
+        """Loads a matrix saved with save.
+
+        Args:
+            path (str): .npz file to read
+
+        Returns (DocumentTermMatrix):
+            the saved matrix
+        """
+        with np.load(path) as f:
+            matrix = sp.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+            if 'vocabulary_lengths' not in f.files:
+                # written before the strings were stored as utf8 bytes
+                return cls(matrix, f['vocabulary'].tolist(), f['documents'].tolist())
+            return cls(matrix, _unpack_strings(f['vocabulary'], f['vocabulary_lengths']),
+                       _unpack_strings(f['documents'], f['documents_lengths']))
@@ -0,0 +1,47 @@
+import tracemalloc
+
+import pytest
+import spacy
+
+from n_gram_correlation import NGramCorrelateSpacy
+
+KEYWORDS = ["climate change", "renewable energy", "flood early warning", "drought resilience"]
+# every sentence is different, so the distinct n-grams and word forms grow with the document
+SENTENCE = ("The national adaptation plan sets out measures for flood early warning systems "
+            "and drought resilience in rural districts number {}. ")
+
+# the candidate index arrays and the token arrays of the cascade, an order of
+# magnitude below an embedding (2 KB) per n-gram
+MAX_BYTES_PER_TOKEN = 200
+
+
+def _scoring_memory(n_gram_cor, doc):
+    """Returns the peak and the retained memory of scoring all 2- to 4-grams of a document."""
+    tracemalloc.start()
+    try:
+        for starts, ends, scores in n_gram_cor.iter_n_gram_scores(doc, [2, 3, 4]):
+            pass
+        # the batches are views of the candidate arrays of the whole document
+        del starts, ends, scores
+        retained, peak = tracemalloc.get_traced_memory()
+        return peak, retained
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize('prescore_threshold', [None, 0.1])
+def test_scoring_memory_is_bounded_by_the_budget(prescore_threshold):
+    nlp = spacy.blank('en')
+    nlp.add_pipe('sentencizer')
+    n_gram_cor = NGramCorrelateSpacy(KEYWORDS, 0.5, "CLIMATE_N", memory_budget_mb=1,
+                                     encoder="hashed-ngram",
+                                     prescore_threshold=prescore_threshold)
+    small, large = (nlp(''.join(SENTENCE.format(i) for i in range(n))) for n in (600, 2400))
+
+    small_peak, small_retained = _scoring_memory(n_gram_cor, small)
+    large_peak, large_retained = _scoring_memory(n_gram_cor, large)
+
+    assert large_peak - small_peak < MAX_BYTES_PER_TOKEN * (len(large) - len(small))
+    # nothing of the n-grams is kept after scoring
+    assert small_retained < 256 * 1024
+    assert large_retained < 256 * 1024
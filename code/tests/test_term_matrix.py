@@ -0,0 +1,33 @@
+import numpy as np
+import scipy.sparse as sp
+
+from term_matrix import DocumentTermMatrix
+
+# trailing whitespace and NUL characters, non-ASCII text and an empty term
+TERMS = ['adaptation', 'climate ', 'climate', 'énergie', 'water\x00', '', 'food\nsecurity']
+
+
+def test_save_load_round_trip(tmp_path):
+    dtm = DocumentTermMatrix.from_docs([TERMS[:4], TERMS[2:] + ['climate']], ['doc a ', 'dóc b'])
+    path = str(tmp_path / 'dtm.npz')
+    dtm.save(path)
+
+    loaded = DocumentTermMatrix.load(path)
+    assert loaded.vocabulary == dtm.vocabulary
+    assert loaded.documents == dtm.documents
+    assert loaded.matrix.shape == dtm.matrix.shape
+    assert (loaded.matrix != dtm.matrix).nnz == 0
+    assert loaded.keyword_frequencies({'t': ['climate', 'climate ']}, 't').values.tolist() == [[1, 1], [2, 0]]
+
+
+def test_load_fixed_width_strings(tmp_path):
+    path = str(tmp_path / 'dtm.npz')
+    matrix = sp.csr_matrix(np.array([[1, 0], [2, 3]]))
+    np.savez_compressed(path, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                        shape=np.array(matrix.shape), vocabulary=np.array(['a', 'b'], dtype=str),
+                        documents=np.array(['x', 'y'], dtype=str))
+
+    loaded = DocumentTermMatrix.load(path)
+    assert loaded.vocabulary == ['a', 'b']
+    assert loaded.documents == ['x', 'y']
+    assert loaded.matrix.toarray().tolist() == [[1, 0], [2, 3]]
@@ -0,0 +1,93 @@
+"""textutils.chunked_reader for GIZ-Policy"""
+
+import codecs
+import mmap
+import os
+import re
+from typing import Iterator, Tuple
+
+ALIGNMENTS = ('paragraph', 'sentence')
+
+_PARAGRAPH_BREAK = re.compile(r'\n[ \t\r\f\v]*\n\s*')
+_SENTENCE_END = re.compile(r'[.!?]["\'\)\]]*\s+')
+_LINE_BREAK = re.compile(r'\n')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class ChunkedTextReader:
+    """Reads a large text file as a stream of aligned chunks
+
+    The file is memory-mapped and decoded block by block with an incremental
+    UTF-8 decoder that drops invalid bytes (like reading it with
+    codecs.open(path, errors="ignore", encoding="utf8")), so neither the raw
+    bytes nor the whole decoded text are ever held in memory. Chunks end at a
+    paragraph break (or, with align='sentence', at the end of a sentence)
+    within the last half of chunk_chars characters, falling back to a line
+    break, a space and finally a hard cut. Every chunk comes with the
+    position of its first character in the decoded text of the whole file;
+    the chunks concatenated are exactly that text.
+
+        Typical usage example:
+
+        for start, text in ChunkedTextReader("ocr_dump.txt", chunk_chars=100000):
+            tokens = nlp(text)
+
+    Args:
+        path (str): path of the text file
+        chunk_chars (int): largest number of characters of a chunk
+        align (str): where chunks end, one of ALIGNMENTS
+        block_bytes (int): number of bytes decoded at a time
+    """
+
+    def __init__(self, path: str, chunk_chars: int = 100000, align: str = 'paragraph',
+                 block_bytes: int = 1 << 20) -> None:
+        if align not in ALIGNMENTS:
+            raise ValueError(f"Unknown alignment '{align}', choose one of {ALIGNMENTS}")
+        if chunk_chars < 2:
+            raise ValueError("chunk_chars has to be at least 2")
+        self.path = path
+        self.chunk_chars = chunk_chars
+        self.align = align
+        self.block_bytes = block_bytes
+
+    def _iter_blocks(self) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder('utf8')(errors='ignore')
+        if os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for position in range(0, len(data), self.block_bytes):
+                yield decoder.decode(data[position:position + self.block_bytes])
+        yield decoder.decode(b'', final=True)
+
+    def _cut(self, text: str) -> int:
+        """Finds the end of the next chunk in a text longer than chunk_chars."""
+        low, high = self.chunk_chars // 2, self.chunk_chars
+        patterns = [_PARAGRAPH_BREAK, _LINE_BREAK, _WHITESPACE]
+        if self.align == 'sentence':
+            patterns.insert(0, _SENTENCE_END)
+        for pattern in patterns:
+            end = None
+            for match in pattern.finditer(text, low, high):
+                end = match.end()
+            if end is not None:
+                return end
+        return high
+
+    def __iter__(self) -> Iterator[Tuple[int, str]]:
+        """Yields the chunks of the file.
+
+        Returns (Iterator[Tuple[int, str]]):
+            the position of the first character of the chunk in the decoded
+            text of the file, and the text of the chunk
+        """
+        buffer = ''
+        start = 0
+        for block in self._iter_blocks():
+            buffer += block
+            while len(buffer) > self.chunk_chars:
+                end = self._cut(buffer)
+                yield start, buffer[:end]
+                start += end
+                buffer = buffer[end:]
+        if buffer:
+            yield start, buffer
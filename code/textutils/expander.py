@@ -0,0 +1,227 @@
+"""textutils.expander for GIZ-Policy"""
+
+import re
+import string
+import sys
+import contractions
+import numpy as np
+from typing import Dict, List, Set, Tuple
+
+# textsearch (used by contractions.fix) treats every other character as a word boundary
+_NON_WORD = re.compile('[^a-z0-9_]+')
+# boundary characters that commonly lead or trail a word
+_EDGE_PUNCTUATION = string.punctuation.replace('_', '')
+
+
+def _word_runs(text: str) -> List[str]:
+    """Splits lowercase text into its runs of textsearch word characters."""
+    return [run for run in _NON_WORD.split(text) if run]
+
+
+def _contraction_key_runs() -> Set[str]:
+    """Collects the word character runs of all keys of the contractions tables.
+
+    A key can only match inside a word with word boundaries on both sides, so
+    each of its runs is then also a complete run of the (lowercase) word. A word
+    none of whose runs is in this set is returned unchanged by contractions.fix.
+    """
+    keys = set(contractions.contractions_dict)
+    keys.update(contractions.leftovers_dict)
+    keys.update(contractions.slang_dict)
+    key_runs = set()
+    for key in keys:
+        key_runs.update(_word_runs(key.lower()))
+    return key_runs
+
+
+def _whitespace_table() -> np.ndarray:
+    """Builds a lookup table of the code points str.split() splits on."""
+    table = np.zeros(sys.maxunicode + 1, dtype=bool)
+    table[[c for c in range(sys.maxunicode + 1) if chr(c).isspace()]] = True
+    return table
+
+
+def _word_spans(text: str, whitespace: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds the start and length of every word of text.split() in the text."""
+    codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    is_word_char = np.concatenate(([False], ~whitespace[codepoints], [False]))
+    boundaries = np.diff(is_word_char.astype(np.int8))
+    starts = np.flatnonzero(boundaries == 1)
+    ends = np.flatnonzero(boundaries == -1)
+    return starts, ends - starts
+
+
+class _ExpansionMemo(dict):
+    """Expansions of word forms, each computed on the first lookup of the word
+
+    Looking up a word that was seen before is a plain dict lookup. A new word
+    is only passed to contractions.fix if one of its word character runs is a
+    run of a key of the contractions tables, otherwise it maps to itself.
+
+    Args:
+        key_runs (Set[str]): word character runs of the contractions table keys
+    """
+
+    def __init__(self, key_runs: Set[str]) -> None:
+        super().__init__()
+        self.key_runs = key_runs
+        self.changed: Dict[str, str] = {}
+
+    def __missing__(self, word: str) -> str:
+        # runs once per distinct word form, so it is kept to a single frame
+        lower = word.lower().strip(_EDGE_PUNCTUATION)
+        if lower.isascii() and lower.isalnum():
+            # the common case: a single run, possibly between punctuation
+            candidate = lower in self.key_runs
+        else:
+            candidate = not self.key_runs.isdisjoint(_NON_WORD.split(lower))
+        expanded = self[word] = contractions.fix(word) if candidate else word
+        if expanded != word:
+            self.changed[word] = expanded
+        return expanded
+
+
+class OffsetMap:
+    """Maps character positions of an expanded text back to its source text
+
+    The expanded text consists of the expanded words of the source, joined by
+    single spaces. Positions inside a word that was not changed map exactly to
+    the source; positions inside an expanded word map into the source word
+    they came from (clipped to its last character), and the separating spaces
+    map to the end of the preceding source word.
+
+    Example:
+        expanded_text, offsets = ContractionExpander().expand_with_offsets(text)
+        source_start = offsets.to_source(ent.start_char)
+
+    Args:
+        expanded_starts (np.ndarray): start of every word in the expanded text
+        expanded_lengths (np.ndarray): length of every word in the expanded text
+        source_starts (np.ndarray): start of every word in the source text
+        source_lengths (np.ndarray): length of every word in the source text
+    """
+
+    def __init__(self, expanded_starts: np.ndarray, expanded_lengths: np.ndarray,
+                 source_starts: np.ndarray, source_lengths: np.ndarray) -> None:
+        self.expanded_starts = expanded_starts
+        self.expanded_lengths = expanded_lengths
+        self.source_starts = source_starts
+        self.source_lengths = source_lengths
+
+    def __len__(self) -> int:
+        return len(self.expanded_starts)
+
+    def to_source(self, positions):
+        """Maps character positions in the expanded text to the source text.
+
+        Args:
+            positions (int or array-like): character positions in the expanded text
+
+        Returns (int or np.ndarray):
+            corresponding character positions in the source text
+        """
+        scalar = np.isscalar(positions)
+        positions = np.atleast_1d(np.asarray(positions, dtype=np.int64))
+        if len(self) == 0:
+            mapped = np.zeros_like(positions)
+            return int(mapped[0]) if scalar else mapped
+
+        word = np.searchsorted(self.expanded_starts, positions, side='right') - 1
+        word = np.clip(word, 0, len(self) - 1)
+        offset = np.maximum(positions - self.expanded_starts[word], 0)
+        in_word = offset < self.expanded_lengths[word]
+        # inside unchanged words the offset carries over, expanded words are clipped
+        offset = np.where(in_word, np.minimum(offset, self.source_lengths[word] - 1),
+                          self.source_lengths[word])
+        mapped = self.source_starts[word] + offset
+        return int(mapped[0]) if scalar else mapped
+
+
+class ContractionExpander:
+    """Expands contractions of a text in a single pass over its words
+
+    This gives the same result as applying contractions.fix to every
+    whitespace-separated word and joining them with single spaces (see
+    nlppreprocess.fix_contractions), but contractions.fix is only called for
+    words that can contain a key of the contractions tables, and only once per
+    distinct word form. The outcome of every word form is memoized for the
+    lifetime of the expander, so once the memo is warm a text costs little
+    more than text.split() and ' '.join(); it pays off to reuse one expander
+    across documents.
+
+    Example:
+        expander = ContractionExpander()
+        expanded_text = expander.expand("We can't stop here")
+        expanded_text, offsets = expander.expand_with_offsets("We can't stop here")
+
+    Parameters:
+        memo (Dict[str, str]): expansion of every word form seen so far
+        changed (Dict[str, str]): the subset of memo whose expansion differs from the word
+    """
+
+    _key_runs = None
+    _whitespace = None
+
+    def __init__(self) -> None:
+        if ContractionExpander._key_runs is None:
+            ContractionExpander._key_runs = _contraction_key_runs()
+        self.memo: Dict[str, str] = _ExpansionMemo(self._key_runs)
+        self.changed: Dict[str, str] = self.memo.changed
+
+    def expand_word(self, word: str) -> str:
+        """Expands the contractions of one word.
+
+        Args:
+            word (str): a word without whitespace
+
+        Returns (str):
+            the word as contractions.fix would return it
+        """
+        return self.memo[word]
+
+    def _expand_words(self, words: List[str]) -> str:
+        """Expands a list of words and joins them with single spaces.
+
+        Every word is a single dict lookup in the memo, only words that were
+        not seen before are expanded (see _ExpansionMemo).
+        """
+        return ' '.join(map(self.memo.__getitem__, words))
+
+    def expand(self, text: str) -> str:
+        """Expands the contractions of a text.
+
+        Args:
+            text (str): source text
+
+        Returns (str):
+            the expanded words joined by single spaces
+        """
+        return self._expand_words(text.split())
+
+    def expand_with_offsets(self, text: str) -> Tuple[str, OffsetMap]:
+        """Expands the contractions of a text and maps the result back to it.
+
+        Args:
+            text (str): source text
+
+        Returns:
+            expanded_text (str): the expanded words joined by single spaces
+            offsets (OffsetMap): map of the expanded text positions to the source text
+        """
+        if ContractionExpander._whitespace is None:
+            ContractionExpander._whitespace = _whitespace_table()
+
+        words = text.split()
+        expanded_text = self._expand_words(words)
+
+        source_starts, source_lengths = _word_spans(text, self._whitespace)
+        expanded_lengths = source_lengths.copy()
+        for i, word in enumerate(words):
+            if word in self.changed:
+                expanded_lengths[i] = len(self.changed[word])
+        expanded_starts = np.zeros(len(words), dtype=np.int64)
+        np.cumsum(expanded_lengths[:-1] + 1, out=expanded_starts[1:])
+
+        offsets = OffsetMap(expanded_starts, expanded_lengths, source_starts,
+                            source_lengths)
+        return expanded_text, offsets
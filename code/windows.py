@@ -0,0 +1,147 @@
+"""Sliding-window topic co-occurrence for GIZ-Policy
+
+Counts the keyword hits of every topic in windows around anchor positions,
+e.g. the NDC keywords of a document, for all windows at once. The hits are
+sorted by position and turned into a cumulative count per topic, so the
+count of a window is the difference of the cumulative counts at its two
+bounds, found with a binary search. Windows are defined on token indices
+(as return_window_i in the windows notebook) or on character offsets (as
+return_window_idx), and nothing is tokenized again.
+
+    Typical usage example:
+
+    matches = KeywordMatcher.from_files(ndc_paths=[ndc_path]).find(doc.text)
+    positions, topic_ids, topics = topic_hit_arrays(matches)
+    anchors = positions[topic_ids == topics.index('climate change NDC')]
+    anchors = filter_anchors_for_overlap(char_to_token_positions(doc, anchors), min_dist=40)
+    counts = window_topic_counts(anchors, char_to_token_positions(doc, positions),
+                                 topic_ids, len(topics), size=20)
+"""
+
+import numpy as np
+import pandas as pd
+from spacy.attrs import IDX
+from spacy.tokens import Doc
+from typing import List, Optional, Sequence, Tuple
+
+WINDOW_MODES = ('token', 'char')
+
+
+def topic_hit_arrays(matches: Sequence[Tuple[str, str, int, int]],
+                     topics: Optional[List[str]] = None) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Turns keyword hits into arrays of positions and topic ids.
+
+    Args:
+        matches (Sequence[Tuple[str, str, int, int]]): topic, keyword, start
+            and end character of every hit, as returned by KeywordMatcher.find
+        topics (Optional[List[str]]): topics to keep, in the order of the topic
+            ids; all topics of the hits in order of appearance if None
+
+    Returns:
+        positions (np.ndarray): start character of every hit
+        topic_ids (np.ndarray): index of the topic of every hit in topics
+        topics (List[str]): the topics
+    """
+    if topics is None:
+        topics = list(dict.fromkeys(topic for topic, _, _, _ in matches))
+    topic_index = {topic: i for i, topic in enumerate(topics)}
+    kept = [(start, topic_index[topic]) for topic, _, start, _ in matches if topic in topic_index]
+    hits = np.array(kept, dtype=np.int64).reshape(-1, 2)
+    return hits[:, 0], hits[:, 1], topics
+
+
+def char_to_token_positions(doc: Doc, char_positions: np.ndarray) -> np.ndarray:
+    """Finds the index of the token containing each character offset of a document.
+
+    Args:
+        doc (Doc): the document the offsets refer to
+        char_positions (np.ndarray): character offsets in doc.text
+
+    Returns (np.ndarray):
+        index of the token starting at or before every offset
+    """
+    token_starts = doc.to_array([IDX]).reshape(-1).astype(np.int64)
+    token_positions = np.searchsorted(token_starts, char_positions, side='right') - 1
+    return np.maximum(token_positions, 0)
+
+
+def filter_anchors_for_overlap(anchors: np.ndarray, min_dist: int) -> np.ndarray:
+    """Keeps the anchors that are at least min_dist before the next anchor.
+
+    This is filter_i_for_overlap of the windows notebook, except that the last
+    anchor is kept, as there is no anchor after it to overlap with.
+
+    Args:
+        anchors (np.ndarray): anchor positions (token indices or character offsets)
+        min_dist (int): minimum distance to the next anchor, at least the window size
+
+    Returns (np.ndarray):
+        the sorted anchors of non-overlapping windows
+    """
+    anchors = np.sort(np.asarray(anchors, dtype=np.int64))
+    distances = np.diff(anchors, append=np.iinfo(np.int64).max)
+    return anchors[distances >= min_dist]
+
+
+def window_bounds(anchors: np.ndarray, size: int, mode: str = 'token') -> Tuple[np.ndarray, np.ndarray]:
+    """Computes the window around every anchor.
+
+    In token mode a window holds the size tokens before and after the anchor
+    token (doc[anchor - size:anchor + size]); in char mode it holds the
+    positions at most size characters away from the anchor, both ends included.
+
+    Args:
+        anchors (np.ndarray): anchor positions
+        size (int): number of tokens or characters on either side of the anchor
+        mode (str): 'token' or 'char'
+
+    Returns:
+        lower (np.ndarray): first position of every window
+        upper (np.ndarray): position after the last position of every window
+    """
+    if mode not in WINDOW_MODES:
+        raise ValueError(f"Unknown window mode '{mode}', use one of {WINDOW_MODES}")
+    anchors = np.asarray(anchors, dtype=np.int64)
+    lower = np.maximum(anchors - size, 0)
+    upper = anchors + size + (1 if mode == 'char' else 0)
+    return lower, upper
+
+
+def window_topic_counts(anchors: np.ndarray, positions: np.ndarray, topic_ids: np.ndarray,
+                        n_topics: int, size: int, mode: str = 'token') -> np.ndarray:
+    """Counts the hits of every topic in the window around every anchor.
+
+    Args:
+        anchors (np.ndarray): anchor positions, one window per anchor
+        positions (np.ndarray): position of every hit, in the unit of the mode
+        topic_ids (np.ndarray): topic index of every hit
+        n_topics (int): number of topics
+        size (int): number of tokens or characters on either side of the anchor
+        mode (str): 'token' or 'char', see window_bounds
+
+    Returns (np.ndarray):
+        array of shape (number of anchors, n_topics) with the hit counts
+    """
+    lower, upper = window_bounds(anchors, size, mode)
+    order = np.argsort(positions, kind='stable')
+    sorted_positions = np.asarray(positions, dtype=np.int64)[order]
+
+    # row k holds the hits per topic among the first k hits
+    cumulative = np.zeros((len(order) + 1, n_topics), dtype=np.int64)
+    cumulative[np.arange(1, len(order) + 1), np.asarray(topic_ids)[order]] = 1
+    np.cumsum(cumulative, axis=0, out=cumulative)
+
+    first = np.searchsorted(sorted_positions, lower, side='left')
+    after_last = np.searchsorted(sorted_positions, upper, side='left')
+    return cumulative[after_last] - cumulative[first]
+
+
+def window_topic_df(anchors: np.ndarray, positions: np.ndarray, topic_ids: np.ndarray,
+                    topics: List[str], size: int, mode: str = 'token') -> pd.DataFrame:
+    """Counts the hits of every topic around every anchor, see window_topic_counts.
+
+    Returns (pd.DataFrame):
+        windows as rows, indexed by their anchor, and topics as columns
+    """
+    counts = window_topic_counts(anchors, positions, topic_ids, len(topics), size, mode)
+    return pd.DataFrame(counts, index=pd.Index(anchors, name='anchor'), columns=topics)